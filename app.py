@@ -2,9 +2,21 @@ from flask import Flask
 
 app = Flask(__name__)
 
-import config
-import routes
-import models
+
+# Application factory. Importing the modules below registers the config,
+# database engine, models, views and commands on app; nothing on the way
+# touches the database, which is created and upgraded by `flask init-db`.
+# Used by `flask` (FLASK_APP=app:create_app) and by WSGI servers, e.g.
+# gunicorn "app:create_app()".
+def create_app():
+    import config
+    import database
+    import routes
+    import models
+    import consistency
+
+    return app
+
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,18 @@
+# Benchmarks of the hot routes against a generated library.
+#
+#   python -m benchmark seed --scale 10000 --seed 1
+#   python -m benchmark run --iterations 200 -o before.json
+#   ... change something ...
+#   python -m benchmark run --iterations 200 -o after.json
+#   python -m benchmark compare before.json after.json
+#   python -m benchmark check-queries
+#   python -m benchmark startup
+#
+# Everything runs against its own database, instance/benchmark.sqlite3
+# unless --database says otherwise, never the one in .env. The same --scale
+# and --seed always generate the same rows, so results of two commits are
+# comparable. compare exits with status 1 when a route got slower or runs
+# more queries than the threshold allows, so it can gate a deploy.
+# check-queries fails when a route runs more SQL statements than its entry
+# in driver.QUERY_BUDGETS, which catches N+1 lazy loads at any --scale, or
+# answers with an error; it runs with the catalog cache disabled.
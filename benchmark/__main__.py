@@ -0,0 +1,130 @@
+import os
+import sys
+
+import click
+
+# the app reads its database from the environment when it is imported, so
+# the benchmark database has to be chosen before that
+DEFAULT_DATABASE = "sqlite:///benchmark.sqlite3"
+
+
+def _use_database(database):
+    os.environ["SQLALCHEMY_DATABASE_URI"] = database
+
+
+@click.group(help="Benchmarks of the hot routes, see benchmark/__init__.py.")
+@click.option(
+    "--database",
+    default=DEFAULT_DATABASE,
+    show_default=True,
+    help="Database to seed and benchmark, relative sqlite paths are in instance/.",
+)
+def cli(database):
+    _use_database(database)
+
+
+@cli.command(help="Fill the benchmark database with generated rows.")
+@click.option("--scale", default=1000, show_default=True, help="Number of books.")
+@click.option("--seed", default=1, show_default=True)
+@click.option("--content-chars", default=5000, show_default=True)
+def seed(scale, seed, content_chars):
+    from app import create_app
+
+    app = create_app()
+    from models import init_db
+    import search
+    import benchmark.data
+
+    with app.app_context():
+        init_db()
+        search.ensure_index()
+        counts = benchmark.data.seed(scale, seed, content_chars)
+    for table, count in counts.items():
+        click.echo(f"{table:<10}{count:>10}")
+
+
+@cli.command(help="Time the hot routes and write the results as JSON.")
+@click.option("--iterations", default=100, show_default=True)
+@click.option("--seed", default=1, show_default=True)
+@click.option("--route", "routes", multiple=True, help="Only these routes.")
+@click.option("-o", "--output", type=click.File("w"), default="-")
+def run(iterations, seed, routes, output):
+    from app import create_app
+
+    app = create_app()
+    from models import db, Books
+    import benchmark.driver
+    import benchmark.results
+
+    routes_results = benchmark.driver.run(iterations, seed, routes)
+    with app.app_context():
+        scale = db.session.query(db.func.count(Books.id)).scalar()
+
+    benchmark.results.save(
+        benchmark.results.make_result(
+            routes_results,
+            database=os.environ["SQLALCHEMY_DATABASE_URI"],
+            scale=scale,
+            seed=seed,
+            iterations=iterations,
+        ),
+        output,
+    )
+
+
+@cli.command(
+    "check-queries",
+    help="Fail when a route runs more SQL statements than its budget.",
+)
+@click.option("--seed", default=1, show_default=True)
+def check_queries(seed):
+    from app import create_app
+
+    create_app()
+    import benchmark.driver
+
+    failures = benchmark.driver.check_queries(seed)
+    for name in benchmark.driver.QUERY_BUDGETS:
+        click.echo(f"{name}: {failures.get(name, 'ok')}")
+    if failures:
+        sys.exit(1)
+
+
+@cli.command(help="Time importing and creating the app in fresh processes.")
+@click.option("--runs", default=10, show_default=True)
+@click.option("-o", "--output", type=click.File("w"), default="-")
+def startup(runs, output):
+    import benchmark.results
+    import benchmark.startup
+
+    benchmark.results.save(
+        benchmark.results.make_result(
+            {"startup": benchmark.startup.measure(runs)},
+            database=os.environ["SQLALCHEMY_DATABASE_URI"],
+            runs=runs,
+        ),
+        output,
+    )
+
+
+@cli.command(help="Compare two result files, exit 1 on a regression.")
+@click.argument("base", type=click.File())
+@click.argument("new", type=click.File())
+@click.option("--threshold", default=0.2, show_default=True, help="Allowed p95 growth.")
+def compare(base, new, threshold):
+    import benchmark.results
+
+    rows, regressions = benchmark.results.compare(
+        benchmark.results.load(base), benchmark.results.load(new), threshold
+    )
+    for row in rows:
+        click.echo(row)
+
+    if regressions:
+        click.echo("\nRegressions:")
+        for regression in regressions:
+            click.echo(f"  {regression}")
+        sys.exit(1)
+
+
+cli()
@@ -0,0 +1,190 @@
+import itertools
+import random
+from datetime import date, timedelta
+
+from models import (
+    db,
+    User,
+    Section,
+    Books,
+    BookPage,
+    Cart,
+    Issued,
+    Feedbacks,
+    FeedbackSummary,
+)
+from passwords import hash_password
+import catalog
+import search
+import feedback_summary
+import fragment_cache
+
+# Synthetic library data. --scale is the number of books, the other tables
+# grow with it:
+#
+#   sections   scale / 100 (at least 1)
+#   users      scale / 10 (at least 10), all with the password "bench"
+#   issued     one loan for half of the books
+#   cart       up to 5 pending requests per user (loans.MAX_REQUESTS)
+#   feedbacks  one per book
+#
+# Dates count from a fixed day so that a seed always gives the same rows.
+
+BATCH_SIZE = 10000
+# books carry their content, so fewer of them per batch
+BOOK_BATCH_SIZE = 1000
+PASSWORD = "bench"
+START = date(2024, 1, 1)
+
+WORDS = (
+    "library river silent garden winter stone letter harbor mountain shadow "
+    "glass empire engine forest voyage lantern crown orchard signal thunder "
+    "paper island mirror north copper history dream market summer echo"
+).split()
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+# rows is any iterable of dicts, inserted BATCH_SIZE at a time so that a
+# million rows never sit in memory at once
+def _insert(model, rows):
+    rows = iter(rows)
+    count = 0
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        db.session.execute(db.insert(model), batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+
+def seed(scale, seed=1, content_chars=5000):
+    rng = random.Random(seed)
+    section_count = max(1, scale // 100)
+    user_count = max(10, scale // 10)
+
+    # the admin created at startup keeps id 1
+    for model in (
+        FeedbackSummary,
+        Feedbacks,
+        Issued,
+        Cart,
+        BookPage,
+        Books,
+        Section,
+    ):
+        db.session.execute(db.delete(model))
+    db.session.execute(db.delete(User).where(User.is_admin.is_(False)))
+    db.session.commit()
+
+    # hashing is deliberately slow, every user shares one hash
+    passhash = hash_password(PASSWORD)
+    users = [
+        {
+            "name": f"Reader {number}",
+            "username": f"user{number}",
+            "passhash": passhash,
+            "is_admin": False,
+        }
+        for number in range(1, user_count + 1)
+    ]
+    _insert(User, users)
+    usernames = dict(
+        db.session.query(User.id, User.username).filter(User.is_admin.is_(False))
+    )
+    user_ids = sorted(usernames)
+
+    section_names = [
+        f"{_words(rng, 2).title()} {number}" for number in range(1, section_count + 1)
+    ]
+    _insert(
+        Section,
+        [
+            {"id": number, "name": name}
+            for number, name in enumerate(section_names, start=1)
+        ],
+    )
+    section_ids = {name: number for number, name in enumerate(section_names, start=1)}
+
+    # books go in the way `flask catalog import` stores them, compressed and
+    # with their reader pages
+    def books():
+        for number in range(1, scale + 1):
+            yield {
+                "name": f"{_words(rng, 3).title()} {number}",
+                "author": f"{_words(rng, 1).title()} {_words(rng, 1).title()}",
+                "content": _words(rng, content_chars // 7),
+                "section": rng.choice(section_names),
+            }
+
+    # book id -> (name, author), copied into loans and feedbacks
+    names = {}
+    for batch in catalog.batched(books(), BOOK_BATCH_SIZE):
+        book_ids = catalog.import_batch(batch, section_ids)
+        names.update(
+            (book_id, (row["name"], row["author"]))
+            for book_id, row in zip(book_ids, batch)
+        )
+
+    # loans and requests go to different books, so no pair is both
+    book_ids = list(names)
+    rng.shuffle(book_ids)
+    issued_books = book_ids[: scale // 2]
+    cart_books = book_ids[scale // 2 :][: user_count * 5]
+
+    def issued():
+        for book_id in issued_books:
+            user_id = rng.choice(user_ids)
+            date_issued = START + timedelta(days=rng.randint(0, 365))
+            yield {
+                "user_id": user_id,
+                "book_id": book_id,
+                "username": usernames[user_id],
+                "book_name": names[book_id][0],
+                "author": names[book_id][1],
+                "date_issued": date_issued,
+                "return_date": date_issued + timedelta(days=rng.randint(1, 30)),
+            }
+
+    def cart():
+        for position, book_id in enumerate(cart_books):
+            user_id = user_ids[position % len(user_ids)]
+            duration = rng.randint(1, 14)
+            yield {
+                "user_id": user_id,
+                "username": usernames[user_id],
+                "book_id": book_id,
+                "duration": duration,
+                "date_requested": START,
+                "return_date": START + timedelta(days=duration),
+            }
+
+    def feedbacks():
+        for book_id in names:
+            user_id = rng.choice(user_ids)
+            yield {
+                "user_id": user_id,
+                "book_id": book_id,
+                "username": usernames[user_id],
+                "book_name": names[book_id][0],
+                "author": names[book_id][1],
+                "date_of_feedback": START + timedelta(days=rng.randint(0, 365)),
+                "feedback": _words(rng, 20),
+            }
+
+    counts = {
+        "sections": section_count,
+        "users": user_count,
+        "books": scale,
+        "issued": _insert(Issued, issued()),
+        "cart": _insert(Cart, cart()),
+        "feedbacks": _insert(Feedbacks, feedbacks()),
+    }
+
+    search.rebuild_index()
+    feedback_summary.rebuild()
+    fragment_cache.bump_version()
+    db.session.commit()
+
+    return counts
@@ -0,0 +1,200 @@
+import random
+import time
+from datetime import date
+
+from app import app
+from models import db, User, Books, Cart
+import profiling
+import fragment_cache
+import benchmark.data
+from benchmark.results import percentile
+
+# Times the hot routes through Flask's test client, so the numbers are the
+# application and database without a web server or network in between.
+# Each route is requested once untimed (warm caches, the first pdf render)
+# and then --iterations times; every request records its latency and the
+# SQL statements it ran.
+
+
+# the admin created on startup
+ADMIN_PASSWORD = "admin"
+
+
+def _login(username, password):
+    client = app.test_client()
+    response = client.post("/login", data={"username": username, "password": password})
+    if response.location.endswith("/login"):
+        raise RuntimeError(f"Could not log in as {username}")
+    return client
+
+
+# name -> (client role, function(client, rng) making one request). A
+# function may return a cleanup callable that runs outside the timing.
+def _scenarios(book_count, user_id, search_word):
+    def random_book(rng):
+        return rng.randint(1, book_count)
+
+    def add_to_cart(client, rng):
+        response = client.post(
+            f"/add_to_cart/{random_book(rng)}", data={"duration": "7"}
+        )
+
+        # keep the user under the request limit for the next iteration, the
+        # generated requests are all dated data.START
+        def cleanup():
+            db.session.execute(
+                db.delete(Cart).where(
+                    Cart.user_id == user_id, Cart.date_requested == date.today()
+                )
+            )
+            db.session.commit()
+
+        return response, cleanup
+
+    return {
+        "index": ("user", lambda client, rng: client.get("/")),
+        "index_search": (
+            "user",
+            lambda client, rng: client.get(
+                f"/?parameter=book_name&query={search_word}"
+            ),
+        ),
+        "admin": ("admin", lambda client, rng: client.get("/admin")),
+        "cart": ("admin", lambda client, rng: client.get("/cart")),
+        "issued_books": ("admin", lambda client, rng: client.get("/issued_books")),
+        "library": ("user", lambda client, rng: client.get("/issued_books_user")),
+        "add_to_cart": ("user", add_to_cart),
+        # a date before every loan, so the overdue scan runs but revokes
+        # nothing and every iteration does the same work
+        "set_date": (
+            "admin",
+            lambda client, rng: client.post(
+                "/set_date", data={"new_date": "2000-01-01"}
+            ),
+        ),
+        "read_book": (
+            "user",
+            lambda client, rng: client.get(f"/readbook/{random_book(rng)}?page=1"),
+        ),
+        "download_book": (
+            "user",
+            lambda client, rng: client.get(f"/download_pdf/{rng.randint(1, 5)}"),
+        ),
+    }
+
+
+# most SQL statements a single request may run, whatever the table sizes;
+# python -m benchmark check-queries fails when a route goes over
+QUERY_BUDGETS = {
+    "index": 4,
+    "index_search": 4,
+    "admin": 4,
+    "cart": 3,
+    "issued_books": 3,
+    "library": 3,
+    "add_to_cart": 6,
+    "set_date": 3,
+    "read_book": 6,
+    "download_book": 4,
+}
+
+
+# logged in clients and the scenarios, inside an app context
+def _prepare():
+    book_count = db.session.query(db.func.max(Books.id)).scalar()
+    if not book_count:
+        raise RuntimeError("No books, run python -m benchmark seed first")
+    user = (
+        db.session.query(User.id, User.username)
+        .filter(User.is_admin.is_(False))
+        .order_by(User.id)
+        .first()
+    )
+    clients = {
+        "admin": _login("admin", ADMIN_PASSWORD),
+        "user": _login(user.username, benchmark.data.PASSWORD),
+    }
+    return clients, _scenarios(book_count, user.id, benchmark.data.WORDS[0])
+
+
+# one request; the cleanup and the flash reset are not part of it
+def _request(request, client, rng, counter):
+    counter.reset()
+    started = time.perf_counter()
+    outcome = request(client, rng)
+    elapsed = time.perf_counter() - started
+    query_count = counter.count
+
+    response, cleanup = outcome if isinstance(outcome, tuple) else (outcome, None)
+    if cleanup:
+        cleanup()
+    # flashed messages would pile up in the session cookie
+    with client.session_transaction() as session:
+        session.pop("_flashes", None)
+    return response, elapsed, query_count
+
+
+def run(iterations=100, seed=1, routes=None):
+    results = {}
+    with app.app_context(), profiling.QueryCounter() as counter:
+        clients, scenarios = _prepare()
+        for name, (role, request) in scenarios.items():
+            if routes and name not in routes:
+                continue
+            rng = random.Random(seed)
+            client = clients[role]
+
+            # warm up
+            _request(request, client, rng, counter)
+
+            latencies = []
+            queries = []
+            errors = 0
+            for _ in range(iterations):
+                response, elapsed, query_count = _request(request, client, rng, counter)
+                latencies.append(elapsed * 1000)
+                queries.append(query_count)
+                if response.status_code >= 400:
+                    errors += 1
+
+            results[name] = {
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "mean_ms": round(sum(latencies) / len(latencies), 3),
+                "queries": percentile(queries, 50),
+                "queries_max": max(queries),
+                "errors": errors,
+                "samples": len(latencies),
+            }
+    return results
+
+
+# route name -> error message for every route over its QUERY_BUDGETS entry
+# or answering with an error status
+def check_queries(seed=1):
+    failures = {}
+    # cached catalog pages would hide the queries that render them
+    cache_backend = fragment_cache.backend
+    fragment_cache.backend = fragment_cache.NoCache()
+    try:
+        with app.app_context():
+            clients, scenarios = _prepare()
+            for name, (role, request) in scenarios.items():
+                # warm up, then the same request again, so one-off work such
+                # as the first pdf render is not counted
+                with profiling.QueryCounter() as counter:
+                    _request(request, clients[role], random.Random(seed), counter)
+                try:
+                    with profiling.max_queries(QUERY_BUDGETS[name]) as counter:
+                        response, _, _ = _request(
+                            request, clients[role], random.Random(seed), counter
+                        )
+                except profiling.TooManyQueries as error:
+                    failures[name] = str(error)
+                    continue
+                if response.status_code >= 400:
+                    failures[name] = f"status {response.status_code}"
+    finally:
+        fragment_cache.backend = cache_backend
+    return failures
@@ -0,0 +1,93 @@
+import json
+import math
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+# Result files are JSON:
+#
+#   {
+#     "meta": {"commit": ..., "created": ..., "python": ..., "database": ...,
+#              "scale": ..., "seed": ..., "iterations": ...},
+#     "routes": {
+#       "index": {"p50_ms": 4.1, "p95_ms": 6.0, "p99_ms": 9.3, "mean_ms": 4.5,
+#                 "queries": 3, "queries_max": 3, "errors": 0, "samples": 100},
+#       ...
+#     }
+#   }
+#
+# compare() flags a route whose p95 grew by more than the threshold (a
+# fraction, 0.2 is 20%) or that runs more queries than before.
+
+
+def percentile(values, percent):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_result(routes, **meta):
+    return {
+        "meta": {
+            "commit": _commit(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            **meta,
+        },
+        "routes": routes,
+    }
+
+
+def save(result, file):
+    json.dump(result, file, indent=2, sort_keys=True)
+    file.write("\n")
+
+
+def load(file):
+    return json.load(file)
+
+
+# returns (rows, regressions); rows are printable lines for every route
+def compare(base, new, threshold=0.2):
+    rows = [
+        f"{'route':<16}{'p95 before':>12}{'p95 after':>12}{'change':>9}"
+        f"{'queries':>12}"
+    ]
+    regressions = []
+
+    for name in sorted(set(base["routes"]) | set(new["routes"])):
+        before = base["routes"].get(name)
+        after = new["routes"].get(name)
+        if before is None or after is None:
+            rows.append(f"{name:<16}{'only in ' + ('new' if after else 'base'):>24}")
+            continue
+
+        change = after["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+        queries = f"{before['queries']} -> {after['queries']}"
+        rows.append(
+            f"{name:<16}{before['p95_ms']:>12.2f}{after['p95_ms']:>12.2f}"
+            f"{change:>+9.0%}{queries:>12}"
+        )
+
+        if change > threshold:
+            regressions.append(f"{name}: p95 {change:+.0%}")
+        if after["queries"] > before["queries"]:
+            regressions.append(
+                f"{name}: {before['queries']} -> {after['queries']} queries"
+            )
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{name}: {after['errors']} errors")
+
+    return rows, regressions
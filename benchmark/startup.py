@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmark.results import percentile
+
+# Startup cost of the app: import time and peak RSS of importing app and
+# calling create_app() in fresh interpreters, the interpreter's own startup
+# not included. Works on trees from before the app factory too, so an old
+# commit can be measured for comparison.
+
+# runs in a fresh interpreter, so nothing is imported yet
+STARTUP_CODE = """
+import json, resource, time
+started = time.perf_counter()
+import app
+getattr(app, "create_app", lambda: app.app)()
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def measure(runs=10):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    latencies = []
+    rss = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_CODE],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        measured = json.loads(output.strip().splitlines()[-1])
+        latencies.append(measured["seconds"] * 1000)
+        rss.append(measured["rss_kb"])
+
+    return {
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "rss_kb": percentile(rss, 50),
+        "queries": 0,
+        "queries_max": 0,
+        "errors": 0,
+        "samples": len(latencies),
+    }
@@ -0,0 +1,335 @@
+import csv
+import json
+import sys
+import time
+from collections import Counter, namedtuple
+
+import click
+from flask.cli import AppGroup
+
+from app import app
+from models import db, Section, Books, BookPage
+from pagination import Page, keyset_page, rank_cursor_value
+from compression import pack
+import search
+import fragment_cache
+
+# a section card on the index page: its first page of books and the cursor
+# to the rest of them
+CatalogSection = namedtuple("CatalogSection", ["id", "name", "books", "next_cursor"])
+
+
+# one page of non-empty sections, each with its first page of books
+def catalog_page(after=None, per_page=None, books_per_section=None):
+    per_page = per_page or app.config["CATALOG_SECTIONS_PER_PAGE"]
+    books_per_section = books_per_section or app.config["CATALOG_BOOKS_PER_SECTION"]
+
+    sections = keyset_page(
+        Section.query.filter(Section.books.any()), Section.id, after, per_page
+    )
+    if not sections.items:
+        return Page([], None)
+
+    # first books of every section on the page in one query: a UNION ALL of
+    # per-section range scans over ix_books_section_id, each one limited
+    first_books = [
+        db.select(Books.id)
+        .where(Books.section_id == section.id)
+        .order_by(Books.id)
+        .limit(books_per_section + 1)
+        .subquery()
+        for section in sections.items
+    ]
+    book_ids = db.union_all(*(db.select(books.c.id) for books in first_books))
+    books = (
+        Books.query.filter(Books.id.in_(book_ids))
+        .order_by(Books.section_id, Books.id)
+        .all()
+    )
+
+    books_by_section = {section.id: [] for section in sections.items}
+    for book in books:
+        books_by_section[book.section_id].append(book)
+
+    items = []
+    for section in sections.items:
+        section_books = books_by_section[section.id]
+        next_cursor = None
+        if len(section_books) > books_per_section:
+            section_books = section_books[:books_per_section]
+            next_cursor = section_books[-1].id
+        items.append(
+            CatalogSection(section.id, section.name, section_books, next_cursor)
+        )
+
+    return Page(items, sections.next_cursor)
+
+
+# the next page of books of a single section, for its "more" link
+def section_page(section_id, after=None, per_page=None):
+    section = Section.query.get(section_id)
+    if not section:
+        return Page([], None)
+
+    per_page = per_page or app.config["CATALOG_BOOKS_PER_SECTION"]
+    books = keyset_page(
+        Books.query.filter_by(section_id=section_id), Books.id, after, per_page
+    )
+    return Page(
+        [CatalogSection(section.id, section.name, books.items, books.next_cursor)],
+        None,
+    )
+
+
+# ----------------------------Search results---------------------------------#
+
+# Search results are paged like the catalog, but best match first: sections
+# by the rank of their best matching book, books within a section by their
+# own rank. Both are keyset pages over (rank, id), the cursors are
+# pagination.rank_cursor strings.
+
+
+def _after(rank, column, after):
+    if after is None:
+        return db.true()
+    after_rank, after_id = after
+    return db.or_(rank > after_rank, db.and_(rank == after_rank, column > after_id))
+
+
+def _ranked_books(matches):
+    return db.select(Books.id, Books.section_id, matches.c.rank).join(
+        matches, matches.c.book_id == Books.id
+    )
+
+
+# one page of the sections with matches, each with its best matching books;
+# matches is a search.search_matches() subquery
+def search_page(matches, after=None, per_page=None, books_per_section=None):
+    per_page = per_page or app.config["CATALOG_SECTIONS_PER_PAGE"]
+    books_per_section = books_per_section or app.config["CATALOG_BOOKS_PER_SECTION"]
+
+    ranked = _ranked_books(matches).subquery()
+    best = (
+        db.select(ranked.c.section_id, db.func.min(ranked.c.rank).label("rank"))
+        .group_by(ranked.c.section_id)
+        .subquery()
+    )
+    sections = (
+        db.session.query(Section, best.c.rank)
+        .join(best, best.c.section_id == Section.id)
+        .filter(_after(best.c.rank, Section.id, after))
+        .order_by(best.c.rank, Section.id)
+        .limit(per_page + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(sections) > per_page:
+        sections = sections[:per_page]
+        next_cursor = rank_cursor_value(sections[-1][1], sections[-1][0].id)
+    if not sections:
+        return Page([], None)
+
+    # the best books of every section on the page in one query, numbered
+    # per section by a window function
+    position = (
+        db.func.row_number()
+        .over(
+            partition_by=ranked.c.section_id,
+            order_by=(ranked.c.rank, ranked.c.id),
+        )
+        .label("position")
+    )
+    numbered = (
+        db.select(ranked.c.id, ranked.c.section_id, ranked.c.rank, position)
+        .where(ranked.c.section_id.in_([section.id for section, _ in sections]))
+        .subquery()
+    )
+    rows = (
+        db.session.query(Books, numbered.c.rank)
+        .join(numbered, numbered.c.id == Books.id)
+        .filter(numbered.c.position <= books_per_section + 1)
+        .order_by(numbered.c.section_id, numbered.c.position)
+        .all()
+    )
+
+    books_by_section = {section.id: [] for section, _ in sections}
+    for book, rank in rows:
+        books_by_section[book.section_id].append((book, rank))
+
+    items = [
+        _ranked_section(section, books_by_section[section.id], books_per_section)
+        for section, _ in sections
+    ]
+    return Page(items, next_cursor)
+
+
+# the next matching books of a single section, for its "more" link
+def search_section_page(matches, section_id, after=None, per_page=None):
+    section = Section.query.get(section_id)
+    if not section:
+        return Page([], None)
+
+    per_page = per_page or app.config["CATALOG_BOOKS_PER_SECTION"]
+    rows = (
+        db.session.query(Books, matches.c.rank)
+        .join(matches, matches.c.book_id == Books.id)
+        .filter(
+            Books.section_id == section_id,
+            _after(matches.c.rank, Books.id, after),
+        )
+        .order_by(matches.c.rank, Books.id)
+        .limit(per_page + 1)
+        .all()
+    )
+    return Page([_ranked_section(section, rows, per_page)], None)
+
+
+def _ranked_section(section, rows, per_page):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        book, rank = rows[-1]
+        next_cursor = rank_cursor_value(rank, book.id)
+    return CatalogSection(
+        section.id, section.name, [book for book, _ in rows], next_cursor
+    )
+
+
+# ----------------------------Bulk import---------------------------------#
+
+
+catalog_cli = AppGroup("catalog", help="Manage the book catalog.")
+app.cli.add_command(catalog_cli)
+
+IMPORT_FIELDS = ("name", "author", "section", "content")
+
+
+def read_rows(file, file_format):
+    if file_format == "csv":
+        # book contents can be far larger than the default field limit
+        csv.field_size_limit(sys.maxsize)
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # skipped by valid_rows like an incomplete row
+                    yield None
+
+
+# rows with every field a non-empty string, the others are counted as skipped
+def valid_rows(rows, counts):
+    for row in rows:
+        if isinstance(row, dict) and all(
+            isinstance(row.get(field), str) and row.get(field)
+            for field in IMPORT_FIELDS
+        ):
+            yield row
+        else:
+            counts["skipped"] += 1
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# section name -> id, creating the sections that don't exist yet
+def resolve_sections(names, section_ids):
+    missing = sorted(set(names) - section_ids.keys())
+    if missing:
+        db.session.execute(db.insert(Section), [{"name": name} for name in missing])
+        rows = db.session.query(Section.id, Section.name).filter(
+            Section.name.in_(missing)
+        )
+        section_ids.update((name, id) for id, name in rows)
+    return section_ids
+
+
+# returns the ids of the new books, in the order of the batch
+def import_batch(batch, section_ids):
+    resolve_sections((row["section"] for row in batch), section_ids)
+
+    packed = [pack(row["content"]) for row in batch]
+    book_ids = db.session.scalars(
+        db.insert(Books).returning(Books.id, sort_by_parameter_order=True),
+        [
+            {
+                "name": row["name"],
+                "author": row["author"],
+                "content": blob,
+                "section_id": section_ids[row["section"]],
+            }
+            for row, (blob, pages) in zip(batch, packed)
+        ],
+    ).all()
+
+    db.session.execute(
+        db.insert(BookPage),
+        [
+            {
+                "book_id": book_id,
+                "number": number,
+                "start": start,
+                "end": end,
+                "block_start": block_start,
+                "block_end": block_end,
+            }
+            for book_id, (blob, pages) in zip(book_ids, packed)
+            for number, (start, end, block_start, block_end) in enumerate(
+                pages, start=1
+            )
+        ],
+    )
+    db.session.commit()
+    return book_ids
+
+
+@catalog_cli.command("import", help="Import books from a CSV or JSONL file.")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="Input format (default: from the file extension).",
+)
+@click.option("--batch-size", default=1000, show_default=True)
+def import_command(file, file_format, batch_size):
+    if not file_format:
+        file_format = "csv" if file.name.endswith(".csv") else "jsonl"
+
+    section_ids = dict(db.session.query(Section.name, Section.id))
+    counts = Counter()
+    imported = 0
+    started = time.perf_counter()
+
+    rows = valid_rows(read_rows(file, file_format), counts)
+    try:
+        for batch in batched(rows, batch_size):
+            import_batch(batch, section_ids)
+            imported += len(batch)
+            elapsed = time.perf_counter() - started
+            click.echo(f"{imported} books imported ({imported / elapsed:.0f} rows/s)")
+    finally:
+        # the search index and the catalog version are updated once instead
+        # of per book, also when the import stops halfway, so the batches
+        # committed so far are searchable and shown
+        db.session.rollback()
+        search.rebuild_index()
+        fragment_cache.bump_version()
+        db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    click.echo(
+        f"Imported {imported} books in {elapsed:.1f}s "
+        f"({imported / elapsed if elapsed else 0:.0f} rows/s), "
+        f"skipped {counts['skipped']} invalid or incomplete rows."
+    )
@@ -0,0 +1,92 @@
+import zlib
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+from app import app
+
+# Book contents are stored zlib compressed, one independent zlib stream per
+# reader page, concatenated after a short magic prefix:
+#
+#   b"ZLP1" + zlib(page 1) + zlib(page 2) + ...
+#
+# Compressing page by page costs a little ratio but lets the reader fetch
+# and decompress a single page with substr() on the blob (the byte offsets
+# of every page are kept in BookPage), while the whole text still
+# decompresses in one pass for downloads and edits.
+MAGIC = b"ZLP1"
+
+
+def split_pages(content, page_chars=None):
+    page_chars = page_chars or app.config["READER_PAGE_CHARS"]
+
+    pages = []
+    start = 0
+    while start < len(content):
+        end = min(start + page_chars, len(content))
+        if end < len(content):
+            # end the page after the last space or newline in its second
+            # half, so that words are not cut in two
+            lowest = start + page_chars // 2
+            space = max(
+                content.rfind(" ", lowest, end), content.rfind("\n", lowest, end)
+            )
+            if space != -1:
+                end = space + 1
+        pages.append((start, end))
+        start = end
+    return pages
+
+
+# returns the compressed blob and, per page, its character offsets in the
+# text and its byte offsets in the blob
+def pack(content):
+    level = app.config["CONTENT_COMPRESSION_LEVEL"]
+
+    blocks = [MAGIC]
+    pages = []
+    offset = len(MAGIC)
+    for start, end in split_pages(content):
+        block = zlib.compress(content[start:end].encode("utf-8"), level)
+        blocks.append(block)
+        pages.append((start, end, offset, offset + len(block)))
+        offset += len(block)
+    return b"".join(blocks), pages
+
+
+def is_packed(value):
+    return isinstance(value, bytes) and value.startswith(MAGIC)
+
+
+def unpack(blob):
+    parts = []
+    data = blob[len(MAGIC) :]
+    while data:
+        stream = zlib.decompressobj()
+        parts.append(stream.decompress(data).decode("utf-8"))
+        data = stream.unused_data
+    return "".join(parts)
+
+
+def unpack_page(block):
+    return zlib.decompress(block).decode("utf-8")
+
+
+# A text column stored compressed. Python code reads and writes plain str;
+# already packed bytes are stored as they are, and rows written before the
+# column was compressed (plain text) are returned unchanged until
+# `flask books compress` converts them.
+class CompressedText(TypeDecorator):
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return pack(value)[0]
+
+    def process_result_value(self, value, dialect):
+        if is_packed(value):
+            return unpack(value)
+        if isinstance(value, bytes):
+            return value.decode("utf-8")
+        return value
@@ -0,0 +1,58 @@
+import hashlib
+from datetime import timezone
+
+from flask import make_response, request, session
+
+# Conditional GET support. A view computes a strong ETag (and optionally a
+# Last-Modified time) from cheap version data such as updated_at columns or
+# the catalog version, and passes the expensive part, rendering a template
+# or generating a pdf, as a callable that only runs when the client's copy
+# is out of date.
+
+
+# the page also depends on who is looking at it and on the query string
+def make_etag(*parts):
+    digest = hashlib.sha256()
+    viewer = (session.get("user_id"), session.get("is_admin"), request.full_path)
+    for part in viewer + parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _http_time(value):
+    # updated_at columns hold naive UTC times, HTTP dates have no fractions
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def _is_fresh(etag, last_modified):
+    if request.method not in ("GET", "HEAD"):
+        return False
+    # a pending flash message has to be rendered, not served from the cache
+    if session.get("_flashes"):
+        return False
+
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def respond(etag, last_modified, render):
+    last_modified = _http_time(last_modified)
+
+    if _is_fresh(etag, last_modified):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # pages depend on the logged in user, browsers revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
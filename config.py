@@ -9,3 +9,74 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("SQLALCHEMY_DATABASE_URI")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = os.getenv(
     "SQLALCHEMY_TRACK_MODIFICATIONS"
 )
+
+# rendered book pdfs, see pdf_cache.py
+app.config["PDF_CACHE_DIR"] = os.getenv(
+    "PDF_CACHE_DIR", os.path.join(app.instance_path, "pdf_cache")
+)
+app.config["PDF_CACHE_MAX_BYTES"] = int(
+    os.getenv("PDF_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+app.config["PDF_WORKERS"] = int(os.getenv("PDF_WORKERS", 2))
+app.config["PDF_RENDER_TIMEOUT"] = int(os.getenv("PDF_RENDER_TIMEOUT", 120))
+
+# seconds between background sweeps of overdue loans, 0 disables the sweeper
+# (they can still be revoked from the issued books page or `flask loans sweep`)
+app.config["OVERDUE_SWEEP_INTERVAL"] = int(os.getenv("OVERDUE_SWEEP_INTERVAL", 0))
+
+# page sizes of the keyset paginated listings, see pagination.py
+app.config["PAGE_SIZE"] = int(os.getenv("PAGE_SIZE", 50))
+app.config["MAX_PAGE_SIZE"] = int(os.getenv("MAX_PAGE_SIZE", 200))
+app.config["CATALOG_SECTIONS_PER_PAGE"] = int(
+    os.getenv("CATALOG_SECTIONS_PER_PAGE", 10)
+)
+app.config["CATALOG_BOOKS_PER_SECTION"] = int(
+    os.getenv("CATALOG_BOOKS_PER_SECTION", 12)
+)
+
+# seconds a looked up user is shared between requests, 0 disables the cache
+app.config["USER_CACHE_TTL"] = int(os.getenv("USER_CACHE_TTL", 5))
+
+# password hashing, see passwords.py. The method is stored in front of every
+# hash ("scrypt:N:r:p" or "pbkdf2:sha256:iterations"), logins with a hash made
+# by another method are rehashed with this one.
+app.config["PASSWORD_HASH_METHOD"] = os.getenv(
+    "PASSWORD_HASH_METHOD", "scrypt:32768:8:1"
+)
+app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+app.config["PASSWORD_HASH_QUEUE"] = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
+app.config["PASSWORD_HASH_TIMEOUT"] = int(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+# characters per page of the paged book reader, see reader.py
+app.config["READER_PAGE_CHARS"] = int(os.getenv("READER_PAGE_CHARS", 4000))
+
+# zlib level (1-9) of the compressed book contents, see compression.py
+app.config["CONTENT_COMPRESSION_LEVEL"] = int(os.getenv("CONTENT_COMPRESSION_LEVEL", 6))
+
+# read replicas for the read-only views, comma separated database URIs,
+# see routing.py
+app.config["SQLALCHEMY_BINDS"] = {
+    f"read_{number}": uri.strip()
+    for number, uri in enumerate(os.getenv("SQLALCHEMY_READ_URIS", "").split(","))
+    if uri.strip()
+}
+app.config["READ_PRIMARY_STICKY_SECONDS"] = int(
+    os.getenv("READ_PRIMARY_STICKY_SECONDS", 10)
+)
+
+# cache of rendered catalog pages: "memory", "filesystem" or "none",
+# at most CATALOG_CACHE_SIZE pages per process or cache directory,
+# see fragment_cache.py
+app.config["CATALOG_CACHE"] = os.getenv("CATALOG_CACHE", "memory")
+app.config["CATALOG_CACHE_SIZE"] = int(os.getenv("CATALOG_CACHE_SIZE", 256))
+app.config["CATALOG_CACHE_DIR"] = os.getenv(
+    "CATALOG_CACHE_DIR", os.path.join(app.instance_path, "catalog_cache")
+)
+
+# request profiling, see profiling.py: SQL, template and memory figures per
+# route on /metrics (Prometheus text format) and in the log
+app.config["PROFILING"] = bool(int(os.getenv("PROFILING", 0)))
+app.config["SLOW_REQUEST_MS"] = int(os.getenv("SLOW_REQUEST_MS", 500))
+app.config["N_PLUS_ONE_THRESHOLD"] = int(os.getenv("N_PLUS_ONE_THRESHOLD", 10))
+# if set, /metrics wants "Authorization: Bearer <token>"
+app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
@@ -0,0 +1,80 @@
+import click
+
+from app import app
+from models import db, User, Books, Cart, Issued, Feedbacks
+import feedback_summary
+
+# Issued, Feedbacks and Cart keep copies of book and user names so that
+# their pages need no joins. edit_book_post updates the copies in the same
+# transaction as the book; `flask check-names` finds copies that drifted
+# anyway (rows from before that, renamed users) and --fix rewrites them
+# from the source row. Copies whose source row was deleted, like feedbacks
+# of a deleted book, are left alone.
+
+# (copy column, source column, foreign key of the copy, primary key of the source)
+COPIES = [
+    (Issued.book_name, Books.name, Issued.book_id, Books.id),
+    (Issued.author, Books.author, Issued.book_id, Books.id),
+    (Issued.username, User.username, Issued.user_id, User.id),
+    (Feedbacks.book_name, Books.name, Feedbacks.book_id, Books.id),
+    (Feedbacks.author, Books.author, Feedbacks.book_id, Books.id),
+    (Feedbacks.username, User.username, Feedbacks.user_id, User.id),
+    (Cart.username, User.username, Cart.user_id, User.id),
+]
+
+
+def _source(source, foreign_key, primary_key):
+    return db.select(source).where(primary_key == foreign_key).scalar_subquery()
+
+
+# the value is null (so never "different") when the source row is gone
+def drifted(copy, source, foreign_key, primary_key):
+    return copy != _source(source, foreign_key, primary_key)
+
+
+def drifted_ids(copy, source, foreign_key, primary_key):
+    table = copy.class_
+    return db.session.scalars(
+        db.select(table.id)
+        .where(drifted(copy, source, foreign_key, primary_key))
+        .order_by(table.id)
+    ).all()
+
+
+def fix(copy, source, foreign_key, primary_key):
+    return db.session.execute(
+        db.update(copy.class_)
+        .where(drifted(copy, source, foreign_key, primary_key))
+        .values({copy.key: _source(source, foreign_key, primary_key)})
+    ).rowcount
+
+
+@app.cli.command("check-names", help="Find copied book and user names that drifted.")
+@click.option("--fix", "repair", is_flag=True, help="Rewrite them from the source.")
+@click.pass_context
+def check_names_command(ctx, repair):
+    total = 0
+    previews_drifted = False
+    for copy, source, foreign_key, primary_key in COPIES:
+        name = f"{copy.class_.__tablename__}.{copy.key}"
+        ids = drifted_ids(copy, source, foreign_key, primary_key)
+        total += len(ids)
+        if not ids:
+            click.echo(f"{name}: ok")
+            continue
+
+        shown = ", ".join(str(id) for id in ids[:10])
+        more = f" and {len(ids) - 10} more" if len(ids) > 10 else ""
+        click.echo(f"{name}: {len(ids)} drifted (ids {shown}{more})")
+        if repair:
+            fix(copy, source, foreign_key, primary_key)
+            previews_drifted |= copy is Feedbacks.username
+
+    if repair:
+        # the feedback previews carry usernames too
+        if previews_drifted:
+            feedback_summary.rebuild()
+        db.session.commit()
+        click.echo(f"Fixed {total} names")
+    elif total:
+        ctx.exit(1)
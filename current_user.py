@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import namedtuple
+
+from flask import g, session
+
+from app import app
+from models import db, User
+
+# The logged in user, looked up once per request and kept on `g`.
+# Lookups are also shared between requests of this process for
+# USER_CACHE_TTL seconds, so admin pages don't query the user table on every
+# click. A revoked admin right is therefore seen after at most USER_CACHE_TTL
+# seconds by other processes, and immediately by this one once
+# invalidate_user() is called.
+CurrentUser = namedtuple("CurrentUser", ["id", "name", "username", "is_admin"])
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _load_user(user_id):
+    row = (
+        db.session.query(User.id, User.name, User.username, User.is_admin)
+        .filter_by(id=user_id)
+        .first()
+    )
+    return CurrentUser(*row) if row else None
+
+
+def get_user(user_id):
+    ttl = app.config["USER_CACHE_TTL"]
+    now = time.monotonic()
+
+    if ttl:
+        with _cache_lock:
+            cached = _cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    user = _load_user(user_id)
+
+    if ttl:
+        with _cache_lock:
+            # drop the expired entries, so the cache holds the users of the
+            # last USER_CACHE_TTL seconds rather than every user ever seen
+            for expired in [
+                id for id, (expires, _) in _cache.items() if expires <= now
+            ]:
+                del _cache[expired]
+            if user is None:
+                _cache.pop(user_id, None)
+            else:
+                _cache[user_id] = (now + ttl, user)
+    return user
+
+
+def current_user():
+    if "user_id" not in session:
+        return None
+
+    if "current_user" not in g:
+        g.current_user = get_user(session["user_id"])
+    return g.current_user
+
+
+# call after changing a user's profile or role
+def invalidate_user(user_id):
+    with _cache_lock:
+        _cache.pop(user_id, None)
+    g.pop("current_user", None)
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+from app import app
+
+# Database engine tuning, read from the environment before the engine is
+# created. DB_PRESET picks a set of defaults, any single DB_* variable
+# overrides its preset value:
+#
+#   single  one process (flask run, a single gunicorn worker): WAL so that
+#           readers never wait for the writer, a short busy timeout and a
+#           normal connection pool.
+#   multi   several gunicorn workers on one SQLite file: WAL, a long busy
+#           timeout so writers queue instead of failing with
+#           "database is locked", and a small pool per worker because
+#           SQLite allows one writer at a time anyway.
+#
+#   DB_JOURNAL_MODE     PRAGMA journal_mode        (WAL)
+#   DB_SYNCHRONOUS      PRAGMA synchronous         (NORMAL, safe with WAL)
+#   DB_BUSY_TIMEOUT_MS  PRAGMA busy_timeout        (5000 / 15000)
+#   DB_MMAP_SIZE        PRAGMA mmap_size in bytes  (256 MiB)
+#   DB_CACHE_SIZE_KB    PRAGMA cache_size in KiB   (64 MiB)
+#   DB_POOL_SIZE        connections kept per process       (5 / 2)
+#   DB_MAX_OVERFLOW     extra connections under load       (10 / 2)
+#   DB_POOL_RECYCLE     seconds before a connection is replaced (3600)
+#   DB_POOL_PRE_PING    check connections before use (1 / 1)
+
+PRESETS = {
+    "single": {
+        "DB_JOURNAL_MODE": "WAL",
+        "DB_SYNCHRONOUS": "NORMAL",
+        "DB_BUSY_TIMEOUT_MS": 5000,
+        "DB_MMAP_SIZE": 256 * 1024 * 1024,
+        "DB_CACHE_SIZE_KB": 64 * 1024,
+        "DB_POOL_SIZE": 5,
+        "DB_MAX_OVERFLOW": 10,
+        "DB_POOL_RECYCLE": 3600,
+        "DB_POOL_PRE_PING": 1,
+    },
+    "multi": {
+        "DB_JOURNAL_MODE": "WAL",
+        "DB_SYNCHRONOUS": "NORMAL",
+        "DB_BUSY_TIMEOUT_MS": 15000,
+        "DB_MMAP_SIZE": 256 * 1024 * 1024,
+        "DB_CACHE_SIZE_KB": 64 * 1024,
+        "DB_POOL_SIZE": 2,
+        "DB_MAX_OVERFLOW": 2,
+        "DB_POOL_RECYCLE": 3600,
+        "DB_POOL_PRE_PING": 1,
+    },
+}
+
+
+def setting(name):
+    preset = PRESETS[os.getenv("DB_PRESET", "single")]
+    value = os.getenv(name, preset[name])
+    return value if isinstance(preset[name], str) else int(value)
+
+
+def engine_options(uri):
+    options = {
+        "pool_pre_ping": bool(setting("DB_POOL_PRE_PING")),
+        "pool_recycle": setting("DB_POOL_RECYCLE"),
+    }
+    if not uri:
+        return options
+
+    url = make_url(uri)
+    is_sqlite = url.drivername.startswith("sqlite")
+
+    # in-memory SQLite databases live in a single connection (Flask-SQLAlchemy
+    # gives them a StaticPool), there is no pool to size
+    if not (is_sqlite and url.database in (None, "", ":memory:")):
+        options["pool_size"] = setting("DB_POOL_SIZE")
+        options["max_overflow"] = setting("DB_MAX_OVERFLOW")
+
+    if is_sqlite:
+        # the driver's own lock timeout, in seconds
+        options["connect_args"] = {"timeout": setting("DB_BUSY_TIMEOUT_MS") / 1000}
+    return options
+
+
+@event.listens_for(Engine, "connect")
+def sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode = {setting('DB_JOURNAL_MODE')}")
+    cursor.execute(f"PRAGMA synchronous = {setting('DB_SYNCHRONOUS')}")
+    cursor.execute(f"PRAGMA busy_timeout = {setting('DB_BUSY_TIMEOUT_MS')}")
+    cursor.execute(f"PRAGMA mmap_size = {setting('DB_MMAP_SIZE')}")
+    # a negative cache_size is in KiB instead of pages
+    cursor.execute(f"PRAGMA cache_size = -{setting('DB_CACHE_SIZE_KB')}")
+    cursor.close()
+
+
+app.config.setdefault(
+    "SQLALCHEMY_ENGINE_OPTIONS",
+    engine_options(app.config["SQLALCHEMY_DATABASE_URI"]),
+)
+
+# every bind (the read replicas) gets the options for its own URI
+app.config["SQLALCHEMY_BINDS"] = {
+    key: {"url": value, **engine_options(value)} if isinstance(value, str) else value
+    for key, value in app.config.get("SQLALCHEMY_BINDS", {}).items()
+}
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+
+import click
+
+from app import app
+from models import db, Issued, Feedbacks
+
+# Loan and feedback history as CSV or NDJSON. Rows are read with yield_per,
+# so the database driver hands them over in batches and memory stays the
+# same whether a table has a thousand rows or millions; every output line is
+# produced by a generator and can be streamed straight into a Response.
+
+# export name -> (model, date column filtered by --since/--until)
+EXPORTS = {
+    "issued": (Issued, Issued.date_issued),
+    "feedbacks": (Feedbacks, Feedbacks.date_of_feedback),
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_query(name, since=None, until=None, user_id=None, book_id=None):
+    model, date_column = EXPORTS[name]
+
+    query = db.select(*model.__table__.columns).order_by(model.id)
+    if since:
+        query = query.where(date_column >= since)
+    if until:
+        query = query.where(date_column <= until)
+    if user_id:
+        query = query.where(model.user_id == user_id)
+    if book_id:
+        query = query.where(model.book_id == book_id)
+    return query
+
+
+def export_rows(name, file_format, batch_size=1000, **filters):
+    query = export_query(name, **filters)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    columns = list(result.keys())
+
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def line(values):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(values)
+            return buffer.getvalue()
+
+        yield line(columns)
+        for row in result:
+            yield line(row)
+    else:
+        for row in result:
+            yield json.dumps(dict(zip(columns, row)), default=str) + "\n"
+
+
+@app.cli.command("export", help="Export loan or feedback history.")
+@click.argument("name", type=click.Choice(list(EXPORTS)))
+@click.option(
+    "--format", "file_format", type=click.Choice(list(FORMATS)), default="csv"
+)
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--until", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--user", "user_id", type=int)
+@click.option("--book", "book_id", type=int)
+@click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-")
+def export_command(name, file_format, since, until, user_id, book_id, output):
+    for line in export_rows(
+        name,
+        file_format,
+        since=since.date() if since else None,
+        until=until.date() if until else None,
+        user_id=user_id,
+        book_id=book_id,
+    ):
+        output.write(line)
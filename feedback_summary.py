@@ -0,0 +1,190 @@
+import itertools
+import re
+from datetime import datetime
+
+import click
+from flask import get_template_attribute
+from flask.cli import AppGroup
+from markupsafe import Markup
+
+from app import app
+from models import db, Books, Feedbacks, FeedbackSummary
+
+feedbacks_cli = AppGroup("feedbacks", help="Manage book feedbacks.")
+app.cli.add_command(feedbacks_cli)
+
+# Every book with feedbacks has a FeedbackSummary row: the number of
+# feedbacks, the date of the latest one and a short preview of the newest
+# PREVIEW_SIZE. add_feedback() updates it in the transaction that adds the
+# feedback, deleting a book deletes it, and summaries() reads the rows of a
+# whole page of catalog cards in one query.
+
+PREVIEW_SIZE = 3
+PREVIEW_CHARS = 200
+
+BATCH_SIZE = 1000
+
+
+def _entry(username, date_of_feedback, feedback):
+    if len(feedback) > PREVIEW_CHARS:
+        feedback = feedback[: PREVIEW_CHARS - 1] + "…"
+    return {
+        "username": username,
+        "date": date_of_feedback.isoformat(),
+        "feedback": feedback,
+    }
+
+
+# newest feedbacks of a book, a backwards range scan of
+# ix_feedbacks_book_id_date however many feedbacks the book has
+def _preview(book_id):
+    rows = db.session.execute(
+        db.select(Feedbacks.username, Feedbacks.date_of_feedback, Feedbacks.feedback)
+        .where(Feedbacks.book_id == book_id)
+        .order_by(Feedbacks.date_of_feedback.desc(), Feedbacks.id.desc())
+        .limit(PREVIEW_SIZE)
+    )
+    return [_entry(*row) for row in rows]
+
+
+# the caller adds the feedback and commits, together with the summary
+def add_feedback(feedback):
+    db.session.flush()
+
+    day = feedback.date_of_feedback
+    if isinstance(day, datetime):
+        day = day.date()
+    preview = _preview(feedback.book_id)
+
+    # the count is incremented by the database, so two feedbacks saved at
+    # the same time both count
+    updated = db.session.execute(
+        db.update(FeedbackSummary)
+        .where(FeedbackSummary.book_id == feedback.book_id)
+        .values(
+            count=FeedbackSummary.count + 1,
+            latest_date=db.case(
+                (FeedbackSummary.latest_date >= day, FeedbackSummary.latest_date),
+                else_=day,
+            ),
+            preview=preview,
+        )
+    )
+    if not updated.rowcount:
+        db.session.add(
+            FeedbackSummary(
+                book_id=feedback.book_id,
+                count=1,
+                latest_date=day,
+                preview=preview,
+            )
+        )
+
+
+# book id -> FeedbackSummary for the given books, books without feedbacks
+# are missing
+def summaries(book_ids):
+    book_ids = list(book_ids)
+    if not book_ids:
+        return {}
+    return {
+        summary.book_id: summary
+        for summary in FeedbackSummary.query.filter(
+            FeedbackSummary.book_id.in_(book_ids)
+        )
+    }
+
+
+# Catalog cards carry a placeholder comment instead of their summary, so
+# the cached catalog only changes with the books and sections; the index
+# view reads the summaries of the cards on the page and fills them in on
+# every request
+PLACEHOLDER = re.compile(r"<!-- feedback summary (\d+) -->")
+
+
+def placeholder_ids(html):
+    return [int(book_id) for book_id in PLACEHOLDER.findall(html)]
+
+
+def fill(html, summaries):
+    macro = get_template_attribute("feedback_summary.html", "summary")
+    return Markup(
+        PLACEHOLDER.sub(
+            lambda match: str(macro(summaries.get(int(match.group(1))))), html
+        )
+    )
+
+
+# recounts everything from the feedbacks table, for existing databases and
+# after copied names were fixed; the caller commits
+def rebuild():
+    db.session.execute(db.delete(FeedbackSummary))
+    db.session.execute(
+        db.insert(FeedbackSummary).from_select(
+            ["book_id", "count", "latest_date", "preview"],
+            db.select(
+                Feedbacks.book_id,
+                db.func.count(Feedbacks.id),
+                db.func.max(Feedbacks.date_of_feedback),
+                db.literal("[]"),
+            )
+            .join(Books, Books.id == Feedbacks.book_id)
+            .group_by(Feedbacks.book_id),
+        )
+    )
+
+    # the newest PREVIEW_SIZE feedbacks of every book in one pass
+    position = (
+        db.func.row_number()
+        .over(
+            partition_by=Feedbacks.book_id,
+            order_by=(Feedbacks.date_of_feedback.desc(), Feedbacks.id.desc()),
+        )
+        .label("position")
+    )
+    newest = (
+        db.select(
+            Feedbacks.book_id,
+            Feedbacks.username,
+            Feedbacks.date_of_feedback,
+            Feedbacks.feedback,
+            position,
+        )
+        .join(Books, Books.id == Feedbacks.book_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(
+            newest.c.book_id,
+            newest.c.username,
+            newest.c.date_of_feedback,
+            newest.c.feedback,
+        )
+        .where(newest.c.position <= PREVIEW_SIZE)
+        .order_by(newest.c.book_id, newest.c.position)
+    )
+
+    previews = (
+        {"book_id": book_id, "preview": [_entry(*row[1:]) for row in group]}
+        for book_id, group in itertools.groupby(rows, key=lambda row: row[0])
+    )
+    count = 0
+    while batch := list(itertools.islice(previews, BATCH_SIZE)):
+        db.session.execute(db.update(FeedbackSummary), batch)
+        count += len(batch)
+    return count
+
+
+# databases from before the summaries get them once
+def ensure_summaries():
+    if not db.session.query(FeedbackSummary.book_id).first():
+        if db.session.query(Feedbacks.id).first():
+            rebuild()
+            db.session.commit()
+
+
+@feedbacks_cli.command("rebuild")
+def rebuild_command():
+    count = rebuild()
+    db.session.commit()
+    click.echo(f"Rebuilt the feedback summaries of {count} books.")
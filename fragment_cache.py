@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from app import app
+from models import db, CatalogVersion
+
+# Rendered HTML fragments of the catalog page. Every key is prefixed with
+# the catalog version, a counter in the database that the book and section
+# routes bump in the same transaction as their change, so a changed catalog
+# simply stops matching the old entries instead of needing to find and
+# delete them. CATALOG_CACHE picks the backend:
+#
+#   memory      an LRU of CATALOG_CACHE_SIZE fragments per process
+#   filesystem  files under CATALOG_CACHE_DIR, shared by all workers, at
+#               most CATALOG_CACHE_SIZE of them; a hit bumps the file's
+#               modification time and the least recently used files are
+#               evicted, like pdf_cache.evict()
+#   none        no caching
+
+
+# ----------------------------Catalog version---------------------------------#
+
+
+# version and time of the last catalog change, (0, None) before the first
+def catalog_state():
+    row = (
+        db.session.query(CatalogVersion.version, CatalogVersion.updated_at)
+        .filter_by(id=1)
+        .first()
+    )
+    return tuple(row) if row else (0, None)
+
+
+# the caller commits, together with the catalog change
+def bump_version():
+    updated = db.session.execute(
+        db.update(CatalogVersion)
+        .where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1)
+    )
+    if not updated.rowcount:
+        db.session.add(CatalogVersion(id=1, version=1))
+
+
+# ----------------------------Backends---------------------------------#
+
+
+class MemoryCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version, key):
+        with self.lock:
+            value = self.entries.get((version, key))
+            if value is not None:
+                self.entries.move_to_end((version, key))
+            return value
+
+    def set(self, version, key, value):
+        with self.lock:
+            self.entries[(version, key)] = value
+            self.entries.move_to_end((version, key))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class FileSystemCache:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def _file(self, version, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, str(version), f"{digest}.html")
+
+    def get(self, version, key):
+        path = self._file(version, key)
+        try:
+            with open(path, encoding="utf-8") as file:
+                html = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return html
+
+    def set(self, version, key, value):
+        path = self._file(version, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._remove_old_versions(version)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.write(value)
+            os.replace(tmp_path, path)
+        except FileNotFoundError:
+            # another worker moved on to a newer version and removed this one
+            return
+        self._evict(version, keep=path)
+
+    def _evict(self, version, keep):
+        directory = os.path.join(self.path, str(version))
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(".html"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                continue
+
+        # oldest hit first
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.size)]:
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remove_old_versions(self, version):
+        for name in os.listdir(self.path):
+            if name != str(version):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+class NoCache:
+    def get(self, version, key):
+        return None
+
+    def set(self, version, key, value):
+        pass
+
+
+def _make_backend():
+    backend = app.config["CATALOG_CACHE"]
+    if backend == "memory":
+        return MemoryCache(app.config["CATALOG_CACHE_SIZE"])
+    if backend == "filesystem":
+        return FileSystemCache(
+            app.config["CATALOG_CACHE_DIR"], app.config["CATALOG_CACHE_SIZE"]
+        )
+    if backend == "none":
+        return NoCache()
+    raise ValueError(f"Unknown CATALOG_CACHE backend: {backend}")
+
+
+backend = _make_backend()
+
+_counters = {"hits": 0, "misses": 0}
+_counters_lock = threading.Lock()
+
+
+# version is the one catalog_state() returned for this request, so the
+# cache and the ETag never disagree about it
+def cached(version, key, render):
+    html = backend.get(version, key)
+    with _counters_lock:
+        _counters["hits" if html is not None else "misses"] += 1
+
+    if html is None:
+        html = render()
+        backend.set(version, key, html)
+    return Markup(html)
+
+
+def counters():
+    with _counters_lock:
+        return dict(_counters)
@@ -0,0 +1,214 @@
+import threading
+import time
+from datetime import date, timedelta
+
+import click
+from flask.cli import AppGroup
+
+from app import app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Books, Cart, Issued
+
+loans_cli = AppGroup("loans", help="Manage issued books.")
+app.cli.add_command(loans_cli)
+
+
+# a user can have at most this many pending requests
+MAX_REQUESTS = 5
+
+# outcomes of request_book()
+REQUESTED = "requested"
+TOO_MANY_REQUESTS = "too_many_requests"
+ALREADY_ISSUED = "already_issued"
+ALREADY_REQUESTED = "already_requested"
+
+
+# Adds a book request in one transaction. The cap and the "already in your
+# library" check are conditions of the INSERT ... SELECT itself, and a
+# second request for the same book is refused by the unique
+# (user_id, book_id) index on cart, so concurrent clicks cannot get past
+# any of them. On databases with row locks the user row is locked first,
+# which serializes the requests of one user.
+def request_book(user_id, username, book_id, duration):
+    today = date.today()
+
+    db.session.query(User.id).filter_by(id=user_id).with_for_update().first()
+
+    pending = (
+        db.select(db.func.count())
+        .select_from(Cart)
+        .where(Cart.user_id == user_id)
+        .scalar_subquery()
+    )
+    issued = db.exists().where(Issued.user_id == user_id, Issued.book_id == book_id)
+    values = db.select(
+        db.literal(user_id),
+        db.literal(username),
+        db.literal(book_id),
+        db.literal(duration),
+        db.literal(today),
+        db.literal(today + timedelta(days=duration)),
+    ).where(pending < MAX_REQUESTS, ~issued)
+
+    try:
+        result = db.session.execute(
+            db.insert(Cart).from_select(
+                [
+                    "user_id",
+                    "username",
+                    "book_id",
+                    "duration",
+                    "date_requested",
+                    "return_date",
+                ],
+                values,
+            )
+        )
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return ALREADY_REQUESTED
+
+    if result.rowcount:
+        return REQUESTED
+
+    # nothing was inserted, find out which condition refused it
+    if db.session.query(issued).scalar():
+        return ALREADY_ISSUED
+    return TOO_MANY_REQUESTS
+
+
+# ids of the pending requests picked by the batch filters: explicit ids,
+# every request for a book, or every request at least N days old. Filters
+# combine; with none given nothing is picked, never the whole queue.
+def select_requests(cart_ids=None, book_id=None, older_than_days=None):
+    conditions = []
+    if cart_ids is not None:
+        conditions.append(Cart.id.in_(cart_ids))
+    if book_id is not None:
+        conditions.append(Cart.book_id == book_id)
+    if older_than_days is not None:
+        oldest = date.today() - timedelta(days=older_than_days)
+        conditions.append(Cart.date_requested <= oldest)
+
+    if not conditions:
+        return []
+    return db.session.scalars(db.select(Cart.id).where(*conditions)).all()
+
+
+# Moves the picked requests into issued books with one INSERT ... SELECT and
+# one DELETE in a single transaction. Requests for a book the user already
+# has are removed without a new loan. Returns the counts of the batch.
+def approve_requests(**filters):
+    cart_ids = select_requests(**filters)
+    if not cart_ids:
+        db.session.rollback()
+        return {"issued": 0, "removed": 0}
+
+    issued = db.exists().where(
+        Issued.user_id == Cart.user_id, Issued.book_id == Cart.book_id
+    )
+    # requests made before cart had its own dates used the ones on the book
+    date_issued = db.func.coalesce(Cart.date_requested, Books.date_issued, date.today())
+    return_date = db.func.coalesce(Cart.return_date, Books.return_date, date.today())
+    requests = (
+        db.select(
+            Cart.user_id,
+            Cart.book_id,
+            Cart.username,
+            Books.name,
+            Books.author,
+            date_issued,
+            return_date,
+        )
+        .join(Books, Books.id == Cart.book_id)
+        .where(Cart.id.in_(cart_ids), ~issued)
+    )
+
+    inserted = db.session.execute(
+        db.insert(Issued).from_select(
+            [
+                "user_id",
+                "book_id",
+                "username",
+                "book_name",
+                "author",
+                "date_issued",
+                "return_date",
+            ],
+            requests,
+        )
+    )
+    deleted = db.session.execute(db.delete(Cart).where(Cart.id.in_(cart_ids)))
+    db.session.commit()
+    return {"issued": inserted.rowcount, "removed": deleted.rowcount}
+
+
+# Deletes the picked requests with one DELETE and returns the counts.
+def reject_requests(**filters):
+    cart_ids = select_requests(**filters)
+    if not cart_ids:
+        db.session.rollback()
+        return {"rejected": 0}
+
+    deleted = db.session.execute(db.delete(Cart).where(Cart.id.in_(cart_ids)))
+    db.session.commit()
+    return {"rejected": deleted.rowcount}
+
+
+# revokes every loan whose return date is before the given date with a
+# single DELETE statement and returns how many loans were revoked
+def revoke_overdue(on_date):
+    result = db.session.execute(db.delete(Issued).where(Issued.return_date < on_date))
+    db.session.commit()
+    return result.rowcount
+
+
+@loans_cli.command("sweep")
+@click.option(
+    "--date",
+    "on_date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Revoke loans due before this date (default: today).",
+)
+def sweep_command(on_date):
+    on_date = on_date.date() if on_date else date.today()
+    revoked = revoke_overdue(on_date)
+    click.echo(f"Revoked {revoked} overdue books.")
+
+
+# ---------------------------Background sweeper---------------------------------#
+
+
+# runs revoke_overdue() for today's date every OVERDUE_SWEEP_INTERVAL seconds
+# in a daemon thread of this process, disabled when the interval is 0
+def _sweep_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with app.app_context():
+                revoked = revoke_overdue(date.today())
+            if revoked:
+                app.logger.info("Revoked %d overdue books", revoked)
+        except Exception:
+            app.logger.exception("Overdue sweep failed")
+
+
+_sweeper = None
+
+
+def start_sweeper():
+    global _sweeper
+    interval = app.config["OVERDUE_SWEEP_INTERVAL"]
+    if not interval or _sweeper is not None:
+        return
+
+    _sweeper = threading.Thread(
+        target=_sweep_forever, args=(interval,), name="overdue-sweeper", daemon=True
+    )
+    _sweeper.start()
+
+
+# started by the first request, so CLI commands never start the thread
+app.before_request(start_sweeper)
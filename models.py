@@ -1,9 +1,14 @@
+from datetime import datetime
+
+import click
+
 from app import app
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash
+from compression import CompressedText
+from routing import RoutingSession
 
-
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
 
 
 class User(db.Model):
@@ -25,26 +30,70 @@ class Section(db.Model):
 class Books(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # deferred so that listing books never pulls the full text out of the db,
+    # views that need the body load it with db.undefer(Books.content).
+    # Stored zlib compressed page by page, see compression.py
+    content = db.deferred(db.Column(CompressedText, nullable=False))
     author = db.Column(db.String(64), nullable=False)
     date_issued = db.Column(db.Date)  # null as it'll be filled during issuance
     return_date = db.Column(db.Date)  # null as it'll be filled during issuance
-    section_id = db.Column(db.Integer, db.ForeignKey("section.id"), nullable=False)
+    section_id = db.Column(
+        db.Integer, db.ForeignKey("section.id"), nullable=False, index=True
+    )
+    # last change, used for ETag/Last-Modified; null on rows older than it
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
 
     carts = db.relationship("Cart", backref="book", lazy=True)
     issued = db.relationship(
         "Issued", backref="books", lazy=True, cascade="all, delete-orphan"
     )
+    pages = db.relationship("BookPage", lazy=True, cascade="all, delete-orphan")
+    feedback_summary = db.relationship(
+        "FeedbackSummary", uselist=False, lazy=True, cascade="all, delete-orphan"
+    )
+
+
+# page boundaries of a book's content for the paged reader: character
+# offsets in the text and byte offsets of the page's zlib stream in the
+# compressed content, so that a page is read with substr() without loading
+# the book
+class BookPage(db.Model):
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id"), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True)  # starts at 1
+    start = db.Column(db.Integer, nullable=False)
+    end = db.Column(db.Integer, nullable=False)
+    block_start = db.Column(db.Integer)  # null until the book is compressed
+    block_end = db.Column(db.Integer)
 
 
 class Cart(db.Model):
+    # a user can request a book only once, the unique index also serves
+    # the per-user lookups because user_id is its leading column
+    __table_args__ = (
+        db.Index("ix_cart_user_id_book_id", "user_id", "book_id", unique=True),
+        db.Index("ix_cart_book_id", "book_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     username = db.Column(db.String(32), db.ForeignKey("user.username"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("books.id"), nullable=False)
+    # the loan period asked for, kept per request instead of on the book
+    # which all users share
+    duration = db.Column(db.Integer, nullable=False, server_default="1")
+    date_requested = db.Column(db.Date)  # null on requests older than this column
+    return_date = db.Column(db.Date)
 
 
 class Issued(db.Model):
+    __table_args__ = (
+        db.Index("ix_issued_user_id_book_id", "user_id", "book_id", unique=True),
+        db.Index("ix_issued_book_id", "book_id"),
+        db.Index("ix_issued_return_date", "return_date"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("books.id"), nullable=False)
@@ -55,9 +104,24 @@ class Issued(db.Model):
     return_date = db.Column(db.Date, nullable=False)
 
 
+# a single row counting changes to books and sections, cached catalog
+# pages are keyed by it (see fragment_cache.py)
+class CatalogVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
 # keeping the data of feedbacks separately because the
 # feedbacks would remain even if the books are deleted
 class Feedbacks(db.Model):
+    __table_args__ = (
+        db.Index("ix_feedbacks_book_id_date", "book_id", "date_of_feedback"),
+        db.Index("ix_feedbacks_user_id", "user_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("books.id"), nullable=False)
@@ -68,8 +132,70 @@ class Feedbacks(db.Model):
     feedback = db.Column(db.Text, nullable=False)
 
 
-with app.app_context():
+# feedback count, date of the latest feedback and the newest few entries of
+# a book, kept up to date by feedback_summary.py so that catalog cards and
+# the feedback page never count or scan all of a book's feedbacks
+class FeedbackSummary(db.Model):
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id"), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    latest_date = db.Column(db.Date)
+    # [{"username": ..., "date": "YYYY-MM-DD", "feedback": ...}], newest first
+    preview = db.Column(db.JSON, nullable=False, default=list)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+# db.create_all() only creates missing tables, it never touches the tables
+# of an existing database, so columns and indexes added to the models later
+# are created here. New columns must be nullable or have a server_default.
+# Rows that break a new unique index are removed first, keeping the oldest
+# one; indexes that already exist are left alone.
+def upgrade_schema():
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                name = db.engine.dialect.identifier_preparer.quote(column.name)
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                default = ""
+                if column.server_default is not None:
+                    default = f" DEFAULT {column.server_default.arg}"
+                db.session.execute(
+                    db.text(
+                        f"ALTER TABLE {table.name} "
+                        f"ADD COLUMN {name} {column_type}{default}"
+                    )
+                )
+                db.session.commit()
+
+        existing_indexes = {
+            index["name"] for index in inspector.get_indexes(table.name)
+        }
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            if index.unique:
+                columns = ", ".join(column.name for column in index.columns)
+                removed = db.session.execute(
+                    db.text(
+                        f"DELETE FROM {table.name} WHERE id NOT IN "
+                        f"(SELECT min(id) FROM {table.name} GROUP BY {columns})"
+                    )
+                ).rowcount
+                db.session.commit()
+                if removed:
+                    click.echo(
+                        f"Removed {removed} duplicate rows from {table.name} "
+                        f"before creating {index.name}."
+                    )
+            index.create(db.engine)
+
+
+def init_db():
     db.create_all()
+    upgrade_schema()
     # if an admin does not exist
     admin = User.query.filter_by(is_admin=True).first()
     if not admin:
@@ -79,3 +205,20 @@ with app.app_context():
         )
     db.session.add(admin)
     db.session.commit()
+
+
+# creates or upgrades the database, safe to run on every deploy
+@app.cli.command("init-db", help="Create or upgrade the tables and the admin.")
+def init_db_command():
+    # all import this module
+    import search
+    import feedback_summary
+    import reader
+
+    init_db()
+    search.ensure_index()
+    feedback_summary.ensure_summaries()
+    # books from before the paged reader, the reader views never write
+    converted = reader.compress_books()
+    if converted:
+        click.echo(f"Compressed {converted} books.")
@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+from flask import request
+
+from app import app
+
+# One page of rows plus the cursor for the next page (None on the last page).
+# Pages are keyset based: the next page is "rows with key > last key seen",
+# so fetching page 10000 costs the same indexed range scan as page 1.
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+
+# ?per_page= overrides PAGE_SIZE, but never beyond MAX_PAGE_SIZE
+def page_size(default=None):
+    per_page = request.args.get("per_page", type=int)
+    per_page = per_page or default or app.config["PAGE_SIZE"]
+    return max(1, min(per_page, app.config["MAX_PAGE_SIZE"]))
+
+
+def cursor(name="after"):
+    return request.args.get(name, type=int)
+
+
+# `column` must be unique and indexed, usually the primary key
+def keyset_page(query, column, after=None, per_page=None):
+    per_page = per_page or page_size()
+
+    if after is not None:
+        query = query.filter(column > after)
+
+    # one extra row tells us whether there is a next page
+    items = query.order_by(column).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = getattr(items[-1], column.key)
+
+    return Page(items, next_cursor)
+
+
+# Ranked results (searches) are paged by (rank, id). Their cursor is one
+# query argument, "<rank>:<id>"; repr() of a float parses back to the same
+# float, so the next page starts exactly after the last row shown.
+def rank_cursor_value(rank, id):
+    return f"{rank!r}:{id}"
+
+
+def rank_cursor(name="after"):
+    try:
+        rank, id = request.args.get(name, "").split(":")
+        return float(rank), int(id)
+    except ValueError:
+        return None
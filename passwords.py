@@ -0,0 +1,118 @@
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import flash, redirect, request
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import app
+
+# Password hashing runs in a bounded thread pool instead of on the request
+# thread. werkzeug hashes with hashlib's scrypt/pbkdf2, which release the
+# GIL, so the pool keeps the CPU heavy part away from other requests.
+# At most PASSWORD_HASH_WORKERS hashes run at once and PASSWORD_HASH_QUEUE
+# more may wait; past that callers get HashingBusy (backpressure) instead of
+# piling up behind a login spike.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_executor = None
+_slots = None
+_setup_lock = threading.Lock()
+
+_metrics = {
+    "hashes_total": 0,
+    "rejected_total": 0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0,
+    "hash_seconds_total": 0.0,
+    "hash_seconds_max": 0.0,
+}
+_metrics_lock = threading.Lock()
+
+
+def _setup():
+    global _executor, _slots
+    with _setup_lock:
+        if _executor is None:
+            workers = app.config["PASSWORD_HASH_WORKERS"]
+            _slots = threading.BoundedSemaphore(
+                workers + app.config["PASSWORD_HASH_QUEUE"]
+            )
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="password-hash"
+            )
+    return _executor, _slots
+
+
+def _record(queue_wait, hash_time):
+    with _metrics_lock:
+        _metrics["hashes_total"] += 1
+        _metrics["queue_wait_seconds_total"] += queue_wait
+        _metrics["queue_wait_seconds_max"] = max(
+            _metrics["queue_wait_seconds_max"], queue_wait
+        )
+        _metrics["hash_seconds_total"] += hash_time
+        _metrics["hash_seconds_max"] = max(_metrics["hash_seconds_max"], hash_time)
+
+
+def _run(func, *args):
+    executor, slots = _setup()
+
+    if not slots.acquire(timeout=app.config["PASSWORD_HASH_TIMEOUT"]):
+        with _metrics_lock:
+            _metrics["rejected_total"] += 1
+        raise HashingBusy()
+
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            _record(started - submitted, time.perf_counter() - started)
+
+    try:
+        return executor.submit(timed).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, app.config["PASSWORD_HASH_METHOD"])
+
+
+def check_password(passhash, password):
+    return _run(check_password_hash, passhash, password)
+
+
+# the prefix werkzeug writes for a method: it expands short names, e.g.
+# "pbkdf2" is stored as "pbkdf2:sha256:1000000", so the prefix is taken from
+# a real hash, made once per process and method
+@functools.lru_cache
+def _method_prefix(method):
+    return generate_password_hash("", method).split("$", 1)[0]
+
+
+# stored hashes start with their method and parameters, e.g.
+# "scrypt:32768:8:1$salt$hash", so a changed PASSWORD_HASH_METHOD shows up
+# as a different prefix
+def needs_rehash(passhash):
+    prefix = _method_prefix(app.config["PASSWORD_HASH_METHOD"])
+    return passhash.split("$", 1)[0] != prefix
+
+
+def metrics():
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    flash("The server is busy, please try again in a moment")
+    return redirect(request.path)
@@ -0,0 +1,137 @@
+import glob
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app
+
+# Rendered PDFs live in a cache directory, one file per version of a book:
+#   <cache dir>/<book id>-<sha256 of id, name, author and content>.pdf
+# Editing a book changes its hash, so a stale file is never served, and the
+# book id prefix lets edit/delete drop every cached version of that book.
+# The file modification time is bumped on every hit and the least recently
+# used files are evicted once the directory grows past PDF_CACHE_MAX_BYTES.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# renders in progress, so concurrent downloads of one book render it once
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def book_html(name, author, content):
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>{name} by {author}</title>
+    </head>
+    <body>
+        <h1>{name}</h1>
+        <h2>by {author}</h2>
+        <br>
+        <div>{content}</div>
+    </body>
+    </html>
+    """
+
+
+# runs inside a pool process, weasyprint is only ever imported there
+def _render(html_content, path):
+    from weasyprint import HTML
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    HTML(string=html_content).write_pdf(tmp_path)
+    # atomic on the same filesystem, readers never see a half written file
+    os.replace(tmp_path, path)
+    return path
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=app.config["PDF_WORKERS"])
+        return _executor
+
+
+def cache_dir():
+    path = app.config["PDF_CACHE_DIR"]
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_key(book_id, name, author, content):
+    digest = hashlib.sha256()
+    for part in (str(book_id), name, author, content):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cache_path(book_id, name, author, content):
+    key = cache_key(book_id, name, author, content)
+    return os.path.join(cache_dir(), f"{book_id}-{key}.pdf")
+
+
+# returns the path of the rendered pdf, rendering it in the pool on a miss
+def get_pdf(book):
+    path = cache_path(book.id, book.name, book.author, book.content)
+
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    with _pending_lock:
+        future = _pending.get(path)
+        if future is None:
+            html_content = book_html(book.name, book.author, book.content)
+            future = _get_executor().submit(_render, html_content, path)
+            _pending[path] = future
+
+    try:
+        future.result(timeout=app.config["PDF_RENDER_TIMEOUT"])
+    finally:
+        with _pending_lock:
+            if _pending.get(path) is future and future.done():
+                del _pending[path]
+
+    evict(keep=path)
+    return path
+
+
+def invalidate(book_id):
+    for path in glob.glob(os.path.join(cache_dir(), f"{book_id}-*.pdf")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def evict(keep=None):
+    max_bytes = app.config["PDF_CACHE_MAX_BYTES"]
+
+    entries = []
+    total = 0
+    for path in glob.glob(os.path.join(cache_dir(), "*.pdf")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    # oldest hit first
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
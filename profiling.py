@@ -0,0 +1,266 @@
+import re
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+import fragment_cache
+import passwords
+
+# Per request profiling, switched on with PROFILING=1. For every request
+# the wall time, the number and total time of SQL statements (engine
+# events), the time spent rendering templates and the peak of traced Python
+# memory are added to per route totals, served by /metrics in Prometheus
+# text format.
+#
+# Requests slower than SLOW_REQUEST_MS are logged with their figures, and a
+# route that runs one statement shape (the SQL with its IN lists collapsed)
+# more than N_PLUS_ONE_THRESHOLD times in one request is logged as a
+# possible N+1.
+#
+# Figures are taken when the request context is torn down, after a streamed
+# response has been sent. tracemalloc is process wide, so the memory peak
+# of concurrent requests in one process includes each other's allocations.
+
+_totals = defaultdict(Counter)
+_peaks = defaultdict(int)
+_totals_lock = threading.Lock()
+
+_in_list = re.compile(
+    r"\((?:\s*\?\s*,)+\s*\?\s*\)|\((?:\s*%\(\w+\)s\s*,)+\s*%\(\w+\)s\s*\)"
+)
+_spaces = re.compile(r"\s+")
+
+
+# the same query with a different number of IN values is the same shape
+def statement_shape(statement):
+    return _spaces.sub(" ", _in_list.sub("(?)", statement)).strip()
+
+
+def _profiling():
+    return has_request_context() and "profile" in g
+
+
+# ----------------------------Request hooks---------------------------------#
+
+
+def _start_request():
+    g.profile = {
+        "started": time.perf_counter(),
+        "sql_seconds": 0.0,
+        "template_seconds": 0.0,
+        "statements": Counter(),
+    }
+    tracemalloc.reset_peak()
+
+
+def _end_request(exc=None):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+
+    seconds = time.perf_counter() - profile["started"]
+    peak = tracemalloc.get_traced_memory()[1]
+    queries = sum(profile["statements"].values())
+    endpoint = request.endpoint or "none"
+
+    repeated = [
+        (count, shape)
+        for shape, count in profile["statements"].items()
+        if count > app.config["N_PLUS_ONE_THRESHOLD"]
+    ]
+
+    with _totals_lock:
+        totals = _totals[endpoint]
+        totals["requests"] += 1
+        totals["seconds"] += seconds
+        totals["sql_queries"] += queries
+        totals["sql_seconds"] += profile["sql_seconds"]
+        totals["template_seconds"] += profile["template_seconds"]
+        totals["n_plus_one"] += len(repeated)
+        if seconds * 1000 > app.config["SLOW_REQUEST_MS"]:
+            totals["slow"] += 1
+        _peaks[endpoint] = max(_peaks[endpoint], peak)
+
+    for count, shape in repeated:
+        app.logger.warning("Possible N+1 in %s: %d x %s", endpoint, count, shape[:300])
+
+    if seconds * 1000 > app.config["SLOW_REQUEST_MS"]:
+        app.logger.warning(
+            "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms,"
+            " templates %.0f ms, peak memory %d KiB",
+            request.method,
+            request.full_path.rstrip("?"),
+            endpoint,
+            seconds * 1000,
+            queries,
+            profile["sql_seconds"] * 1000,
+            profile["template_seconds"] * 1000,
+            peak // 1024,
+        )
+
+
+def _before_sql(conn, cursor, statement, parameters, context, executemany):
+    if _profiling():
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_sql(conn, cursor, statement, parameters, context, executemany):
+    if _profiling() and conn.info.get("profile_started"):
+        started = conn.info["profile_started"].pop()
+        g.profile["sql_seconds"] += time.perf_counter() - started
+        g.profile["statements"][statement_shape(statement)] += 1
+
+
+def _before_template(sender, template, context, **extra):
+    if _profiling():
+        g.profile["template_started"] = time.perf_counter()
+
+
+def _after_template(sender, template, context, **extra):
+    if _profiling() and "template_started" in g.profile:
+        started = g.profile.pop("template_started")
+        g.profile["template_seconds"] += time.perf_counter() - started
+
+
+if app.config["PROFILING"]:
+    tracemalloc.start()
+    app.before_request(_start_request)
+    app.teardown_request(_end_request)
+    event.listen(Engine, "before_cursor_execute", _before_sql)
+    event.listen(Engine, "after_cursor_execute", _after_sql)
+    before_render_template.connect(_before_template, app)
+    template_rendered.connect(_after_template, app)
+
+
+# ----------------------------Query budgets---------------------------------#
+
+
+class TooManyQueries(AssertionError):
+    pass
+
+
+# counts the SQL statements of every engine while open, whether or not
+# PROFILING is on
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def reset(self):
+        self.statements.clear()
+
+
+# keeps a view O(1) in queries, e.g.
+#   with max_queries(3):
+#       client.get("/cart")
+@contextmanager
+def max_queries(limit):
+    with QueryCounter() as counter:
+        yield counter
+
+    if counter.count > limit:
+        shapes = Counter(statement_shape(statement) for statement in counter.statements)
+        details = "".join(
+            f"\n  {count} x {shape[:200]}" for shape, count in shapes.most_common(5)
+        )
+        raise TooManyQueries(
+            f"{counter.count} queries, at most {limit} allowed:{details}"
+        )
+
+
+# ----------------------------Prometheus---------------------------------#
+
+# name, type, help, per endpoint total
+ROUTE_METRICS = [
+    ("requests_total", "counter", "Requests served.", "requests"),
+    ("request_seconds_total", "counter", "Wall time of requests.", "seconds"),
+    ("slow_requests_total", "counter", "Requests over SLOW_REQUEST_MS.", "slow"),
+    ("sql_queries_total", "counter", "SQL statements executed.", "sql_queries"),
+    ("sql_seconds_total", "counter", "Time spent in SQL.", "sql_seconds"),
+    (
+        "template_seconds_total",
+        "counter",
+        "Time spent rendering templates.",
+        "template_seconds",
+    ),
+    (
+        "n_plus_one_total",
+        "counter",
+        "Statement shapes repeated more than N_PLUS_ONE_THRESHOLD times.",
+        "n_plus_one",
+    ),
+]
+
+
+def _metric(lines, name, metric_type, help_text, samples):
+    lines.append(f"# HELP library_{name} {help_text}")
+    lines.append(f"# TYPE library_{name} {metric_type}")
+    for labels, value in samples:
+        lines.append(f"library_{name}{labels} {value}")
+
+
+def metrics_text():
+    with _totals_lock:
+        totals = {endpoint: Counter(values) for endpoint, values in _totals.items()}
+        peaks = dict(_peaks)
+
+    lines = []
+    for name, metric_type, help_text, key in ROUTE_METRICS:
+        samples = [
+            (f'{{endpoint="{endpoint}"}}', values[key])
+            for endpoint, values in sorted(totals.items())
+        ]
+        _metric(lines, name, metric_type, help_text, samples)
+
+    _metric(
+        lines,
+        "request_peak_memory_bytes",
+        "gauge",
+        "Highest traced memory peak of a request.",
+        [
+            (f'{{endpoint="{endpoint}"}}', peak)
+            for endpoint, peak in sorted(peaks.items())
+        ],
+    )
+
+    for name, value in sorted(passwords.metrics().items()):
+        metric_type = "gauge" if name.endswith("_max") else "counter"
+        _metric(
+            lines, f"password_{name}", metric_type, "Password hashing.", [("", value)]
+        )
+
+    for name, value in sorted(fragment_cache.counters().items()):
+        _metric(
+            lines,
+            f"catalog_cache_{name}_total",
+            "counter",
+            "Catalog fragment cache lookups.",
+            [("", value)],
+        )
+    return "\n".join(lines) + "\n"
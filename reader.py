@@ -0,0 +1,145 @@
+import click
+from flask.cli import AppGroup
+
+from app import app
+from models import db, Books, BookPage
+from compression import MAGIC, pack, unpack_page
+
+# The reader serves a book one page at a time. Page boundaries are worked out
+# once when the book is saved and stored in BookPage together with the byte
+# offsets of the page's zlib stream in the compressed content, so a page is
+# read with substr() in the database and a request never holds more than one
+# page of text in memory, however long the book is.
+
+books_cli = AppGroup("books", help="Manage book contents.")
+app.cli.add_command(books_cli)
+
+
+# compresses the content onto the book and stores its pages,
+# the caller commits, together with the book itself
+def store_pages(book, content):
+    blob, pages = pack(content)
+    book.content = blob
+
+    db.session.flush()
+    BookPage.query.filter_by(book_id=book.id).delete()
+    db.session.add_all(
+        BookPage(
+            book_id=book.id,
+            number=number,
+            start=start,
+            end=end,
+            block_start=block_start,
+            block_end=block_end,
+        )
+        for number, (start, end, block_start, block_end) in enumerate(pages, start=1)
+    )
+
+
+# 0 for books saved before the reader or the compression existed, until
+# `flask books compress` (run by `flask init-db`) converts them
+def page_count(book_id):
+    return (
+        db.session.query(db.func.count(BookPage.number))
+        .filter(BookPage.book_id == book_id, BookPage.block_end.isnot(None))
+        .scalar()
+    )
+
+
+# the whole text of a book that has no pages yet, served as a single page
+def full_content(book_id):
+    return db.session.query(Books.content).filter(Books.id == book_id).scalar()
+
+
+def read_page(book_id, number):
+    # the compressed content is read as raw bytes, only this page's stream
+    content = db.type_coerce(Books.content, db.LargeBinary)
+    block = (
+        db.session.query(
+            db.func.substr(
+                content,
+                BookPage.block_start + 1,
+                BookPage.block_end - BookPage.block_start,
+            )
+        )
+        .join(BookPage, BookPage.book_id == Books.id)
+        .filter(BookPage.book_id == book_id, BookPage.number == number)
+        .scalar()
+    )
+    return unpack_page(block) if block is not None else None
+
+
+# the whole text, one page per query, for a streaming Response
+def stream_content(book_id):
+    numbers = (
+        db.session.query(BookPage.number)
+        .filter(BookPage.book_id == book_id, BookPage.block_end.isnot(None))
+        .order_by(BookPage.number)
+        .all()
+    )
+    if not numbers:
+        yield full_content(book_id) or ""
+    for (number,) in numbers:
+        yield read_page(book_id, number)
+
+
+# ----------------------------Compression migration---------------------------------#
+
+
+def _content_bytes():
+    return db.session.query(
+        db.func.coalesce(
+            db.func.sum(db.func.length(db.cast(Books.content, db.LargeBinary))), 0
+        )
+    ).scalar()
+
+
+# converts the books stored as plain text or without page offsets, in
+# batches of batch_size; returns how many
+def compress_books(batch_size=200):
+    raw_content = db.func.substr(db.type_coerce(Books.content, db.LargeBinary), 1, 4)
+    converted = 0
+    after_id = 0
+    while True:
+        books = (
+            Books.query.options(db.undefer(Books.content))
+            .filter(Books.id > after_id, raw_content != MAGIC)
+            .order_by(Books.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not books:
+            break
+
+        for book in books:
+            store_pages(book, book.content)
+        after_id = books[-1].id
+        converted += len(books)
+        db.session.commit()
+        db.session.expunge_all()
+    return converted
+
+
+@books_cli.command("compress", help="Compress book contents stored as plain text.")
+@click.option("--batch-size", default=200, show_default=True)
+@click.option("--vacuum", is_flag=True, help="VACUUM the database afterwards.")
+def compress_command(batch_size, vacuum):
+    before = _content_bytes()
+    converted = compress_books(batch_size)
+
+    after = _content_bytes()
+    saved = before - after
+    percent = 100 * saved / before if before else 0
+    click.echo(f"Compressed {converted} books.")
+    click.echo(
+        f"Content size: {before} bytes -> {after} bytes, "
+        f"saved {saved} bytes ({percent:.1f}%)."
+    )
+
+    if vacuum:
+        db.session.commit()
+        with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            connection.execute(db.text("VACUUM"))
+        click.echo("Database vacuumed.")
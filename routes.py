@@ -1,10 +1,44 @@
-from flask import flash, redirect, render_template, request, url_for, session, send_file
+from flask import (
+    Response,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for,
+    session,
+    send_file,
+    stream_with_context,
+)
 from app import app
-from models import db, Section, User, Books, Cart, Issued, Feedbacks
-from werkzeug.security import generate_password_hash, check_password_hash
+from models import (
+    db,
+    Section,
+    User,
+    Books,
+    BookPage,
+    Cart,
+    Issued,
+    Feedbacks,
+    FeedbackSummary,
+)
+import search
+import pdf_cache
+import stats
+import loans
+import catalog
+import reader
+import exports
+import fragment_cache
+import feedback_summary
+import conditional
+import profiling
+from pagination import cursor, keyset_page, rank_cursor
+from current_user import current_user, invalidate_user
+from passwords import hash_password, check_password, needs_rehash
+from routing import read_only
 from functools import wraps
-from datetime import datetime, timedelta
-from weasyprint import HTML
+from datetime import datetime
 
 
 # Decorator for authentication of users
@@ -26,7 +60,12 @@ def admin_required(func):
         if "user_id" not in session:
             return redirect(url_for("login"))
 
-        user = User.query.get(session["user_id"])
+        # cached per request and shortly per process, see current_user.py
+        user = current_user()
+
+        if not user:
+            session.pop("user_id")
+            return redirect(url_for("login"))
 
         if not user.is_admin:
             flash("You are not authorized to access this page")
@@ -67,7 +106,7 @@ def register_post():
         flash("User already exists")
         return redirect(url_for("register"))
 
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
 
     new_user = User(username=username, passhash=password_hash, name=name)
     db.session.add(new_user)
@@ -105,10 +144,15 @@ def login_post():
         return redirect(url_for("login"))
 
     # if the user password do not match then it shows error msg
-    if not check_password_hash(user.passhash, password):
+    if not check_password(user.passhash, password):
         flash("Incorrect password")
         return redirect(url_for("login"))
 
+    # upgrades hashes made with an older PASSWORD_HASH_METHOD
+    if needs_rehash(user.passhash):
+        user.passhash = hash_password(password)
+        db.session.commit()
+
     # user_id is a varible and the key of the dictionary session
     session["user_id"] = user.id
     session["is_admin"] = user.is_admin
@@ -137,7 +181,7 @@ def logout():
 @app.route("/profile")
 @auth_required
 def profile():
-    user = User.query.get(session["user_id"])
+    user = current_user()
     return render_template("profile.html", user=user)
 
 
@@ -160,19 +204,21 @@ def profile_post():
             flash("Username already exists")
             return redirect(url_for("profile"))
 
-    if not check_password_hash(user.passhash, cpassword):
+    if not check_password(user.passhash, cpassword):
         flash("Current passwords do not match")
         return redirect(url_for("profile"))
 
-    if check_password_hash(cpassword, password):
+    if check_password(user.passhash, password):
         flash("New password cannot be same as the old password")
         return redirect(url_for("profile"))
 
-    new_password_hash = generate_password_hash(password)
+    new_password_hash = hash_password(password)
     user.username = username
     user.passhash = new_password_hash
     user.name = name
     db.session.commit()
+    invalidate_user(user.id)
+    session["username"] = user.username
     flash("Profile updated successfully")
     return redirect(url_for("profile"))
 
@@ -184,14 +230,15 @@ def profile_post():
 @app.route("/admin")
 @admin_required
 def admin():
-    sections = Section.query.all()
+    sections = stats.section_counts()
     section_names = [section.name for section in sections]
-    section_sizes = [len(section.books) for section in sections]
+    section_sizes = [section.book_count for section in sections]
     return render_template(
         "admin.html",
         sections=sections,
         section_names=section_names,
         section_sizes=section_sizes,
+        counts=stats.library_counts(),
     )
 
 
@@ -212,6 +259,7 @@ def add_section_post():
 
     section = Section(name=name)
     db.session.add(section)
+    fragment_cache.bump_version()
     db.session.commit()
 
     flash("Section created successfully")
@@ -258,6 +306,8 @@ def edit_section_post(id):
 
     # updated with the new section name, committed to the db, success message shown, redirected to admin dashboard
     section.name = name
+    search.index_section(section)
+    fragment_cache.bump_version()
     db.session.commit()
     flash("Section updated successfully")
     return redirect(url_for("admin"))
@@ -281,6 +331,8 @@ def delete_section_post(id):
         flash("Section does not exist")
         return redirect(url_for("admin"))
 
+    search.remove_section(section.id)
+    fragment_cache.bump_version()
     db.session.delete(section)
     db.session.commit()
     flash("Section deleted successfully")
@@ -324,12 +376,16 @@ def add_book_post():
 
     book = Books(
         name=name,
-        content=content,
         author=author,
         section=section,
     )
 
     db.session.add(book)
+    # compresses the content onto the book before anything flushes it, so
+    # it is packed and written once
+    reader.store_pages(book, content)
+    search.index_book(book)
+    fragment_cache.bump_version()
     db.session.commit()
     flash("Book added successfully")
     return redirect(url_for("show_section", id=section_id))
@@ -339,7 +395,7 @@ def add_book_post():
 @admin_required
 def edit_book(id):
     sections = Section.query.all()
-    book = Books.query.get(id)
+    book = Books.query.options(db.undefer(Books.content)).get(id)
     book_date_issued = book.date_issued
     book_return_date = book.return_date
     return render_template(
@@ -371,25 +427,25 @@ def edit_book_post(id):
 
     book = Books.query.get(id)
     book.name = name
-    book.content = content
     book.author = author
     book.section = section
+    # sets the compressed content, before the statements below flush the book
+    reader.store_pages(book, content)
+
+    # edits the book and author name in issued books and feedbacks
+    # when the source book is edited, one UPDATE each however many rows
+    # there are; `flask check-names` finds copies that drifted anyway
+    for model in (Issued, Feedbacks):
+        db.session.execute(
+            db.update(model)
+            .where(model.book_id == id)
+            .values(book_name=name, author=author)
+        )
 
-    # edits the book and author name in issued books
-    # when the source book is edited
-    issued_books = Issued.query.get(id)
-    if issued_books:
-        issued_books.book_name = name
-        issued_books.author = author
-
-    # edits the book and author name in feedbacks
-    # when the source book is edited
-    feedback = Feedbacks.query.get(id)
-    if feedback:
-        feedback.book_name = name
-        feedback.author = author
-
+    search.index_book(book)
+    fragment_cache.bump_version()
     db.session.commit()
+    pdf_cache.invalidate(book.id)
 
     flash("Book edited successfully")
     return redirect(url_for("show_section", id=section_id))
@@ -418,20 +474,18 @@ def delete_book_post(id):
 
     section_id = book.section_id
 
-    # Before deleting the book, we find all Cart items referencing
-    # the book and delete them. This resolves the foreign key constraint violation.
-    cart_items = Cart.query.filter_by(book_id=book.id).all()
-    for item in cart_items:
-        db.session.delete(item)
-
-    # deletes book from library, issued books and user requests
-    # when the source book is deleted
-    delete_issued_books = Issued.query.filter_by(book_id=book.id).all()
-    for issued_book in delete_issued_books:
-        db.session.delete(issued_book)
+    # deletes book from library, issued books, user requests, the reader's
+    # pages and the feedback summary when the source book is deleted, with
+    # one DELETE per table instead of loading every row; feedbacks are kept.
+    # Cart rows go first, they would break the foreign key otherwise
+    for model in (Cart, Issued, BookPage, FeedbackSummary):
+        db.session.execute(db.delete(model).where(model.book_id == id))
 
-    db.session.delete(book)
+    search.remove_book(book.id)
+    fragment_cache.bump_version()
+    db.session.execute(db.delete(Books).where(Books.id == id))
     db.session.commit()
+    pdf_cache.invalidate(id)
 
     flash("Book deleted successfully")
     return redirect(url_for("show_section", id=section_id))
@@ -442,8 +496,8 @@ def delete_book_post(id):
 
 @app.route("/")
 @auth_required
+@read_only
 def index():
-    sections = Section.query.filter(Section.books.any()).all()
     parameter = request.args.get("parameter")
     query = request.args.get("query")
 
@@ -453,39 +507,74 @@ def index():
         "author_name": "Author Name",
     }
 
-    if parameter == "section_name":
-        sections = Section.query.filter(Section.name.ilike(f"%{query}%")).all()
-    elif parameter == "book_name":
-        sections = [
-            section
-            for section in Section.query.all()
-            if any(book for book in section.books if query.lower() in book.name.lower())
-        ]
-    elif parameter == "author_name":
-        sections = [
-            section
-            for section in Section.query.all()
-            if any(
-                book for book in section.books if query.lower() in book.author.lower()
+    # the rendered catalog only changes with the catalog version, so it is
+    # cached per page and per search. The key holds the raw query arguments:
+    # the fragment's paging links repeat them, so a request must never get
+    # the links rendered for a differently spelled one
+    key = repr(
+        tuple(
+            request.args.get(name)
+            for name in (
+                "parameter",
+                "query",
+                "section_id",
+                "after",
+                "after_book",
+                "per_page",
             )
-        ]
-
-    # Filter books within each section
-    for section in sections:
-        if parameter == "book_name":
-            section.books = [
-                book for book in section.books if query.lower() in book.name.lower()
-            ]
-        elif parameter == "author_name":
-            section.books = [
-                book for book in section.books if query.lower() in book.author.lower()
-            ]
+        )
+    )
 
-    return render_template(
-        "index.html",
-        sections=sections,
-        parameters=parameters,
-        query=query,
+    def render():
+        # searches go through the full-text index, best matches first
+        matches = search.search_matches(parameter, query)
+        section_id = request.args.get("section_id", type=int)
+        if matches is not None and section_id:
+            page = catalog.search_section_page(
+                matches, section_id, rank_cursor("after_book")
+            )
+        elif matches is not None:
+            page = catalog.search_page(matches, rank_cursor())
+        elif section_id:
+            # "more" link of a section card
+            page = catalog.section_page(section_id, cursor("after_book"))
+        else:
+            page = catalog.catalog_page(cursor())
+
+        return render_template(
+            "catalog.html",
+            sections=page.items,
+            page=page,
+            parameters=parameters,
+            query=query,
+        )
+
+    version, updated_at = fragment_cache.catalog_state()
+    catalog_html = fragment_cache.cached(version, key, render)
+
+    # the feedback counts of the cards are not cached with the catalog, they
+    # are read in one query per request
+    summaries = feedback_summary.summaries(
+        feedback_summary.placeholder_ids(catalog_html)
+    )
+    feedbacks = sorted(
+        (book_id, summary.count, summary.updated_at)
+        for book_id, summary in summaries.items()
+    )
+    updated_at = max(
+        filter(None, [updated_at, *(changed for _, _, changed in feedbacks)]),
+        default=None,
+    )
+
+    # browsers revalidate with the catalog version and the feedbacks on the
+    # page, and get a 304 until either changes
+    return conditional.respond(
+        conditional.make_etag(version, feedbacks),
+        updated_at,
+        lambda: render_template(
+            "index.html",
+            catalog_html=feedback_summary.fill(catalog_html, summaries),
+        ),
     )
 
 
@@ -495,8 +584,12 @@ def index():
 @app.route("/cart")
 @admin_required
 def cart():
-    carts = Cart.query.all()
-    return render_template("cart.html", carts=carts)
+    # the book's name and author come in the same SELECT, not one per row
+    query = Cart.query.options(
+        db.joinedload(Cart.book).load_only(Books.name, Books.author)
+    )
+    page = keyset_page(query, Cart.id, cursor())
+    return render_template("cart.html", carts=page.items, page=page)
 
 
 @app.route("/add_to_cart/<int:book_id>", methods=["POST"])
@@ -508,40 +601,23 @@ def add_to_cart(book_id):
         flash("Book does not exist")
         return redirect(url_for("index"))
 
-    book.date_issued = datetime.now()
-
-    duration = request.form.get("duration")
-    duration = int(duration)
-    book.return_date = datetime.now() + timedelta(days=duration)
-
-    # check cart size
-    cart_size = Cart.query.filter_by(user_id=session["user_id"]).count()
-    if cart_size >= 5:
-        flash("You cannot request for more than 5 books.")
+    duration = request.form.get("duration", type=int)
+    if not duration or duration < 1:
+        flash("Please choose a duration of at least one day.")
         return redirect(url_for("index"))
 
-    issued_book = Issued.query.filter_by(
-        user_id=session["user_id"], book_id=book_id
-    ).first()
+    # the cap and the duplicate checks run inside one transaction
+    result = loans.request_book(
+        session["user_id"], session["username"], book_id, duration
+    )
 
-    if issued_book:
+    if result == loans.TOO_MANY_REQUESTS:
+        flash(f"You cannot request for more than {loans.MAX_REQUESTS} books.")
+    elif result == loans.ALREADY_ISSUED:
         flash("You already have this book in your library.")
-        return redirect(url_for("index"))
-
-    # checks if an item with the same user_id and book_id already exists
-    cart = Cart.query.filter_by(user_id=session["user_id"], book_id=book_id).first()
-
-    # if it does, then
-    if cart:  # If the book already exists in the cart
+    elif result == loans.ALREADY_REQUESTED:
         flash("You have already requested for this book.")
-    else:  # If the book is new to the cart
-        new_cart_item = Cart(
-            user_id=session["user_id"],
-            book_id=book_id,
-            username=session["username"],
-        )
-        db.session.add(new_cart_item)
-        db.session.commit()
+    else:
         flash("Requested book successfully!")
 
     return redirect(url_for("index"))
@@ -568,32 +644,95 @@ def delete_cart(id):
 @app.route("/issued/<int:id>", methods=["POST"])
 @admin_required
 def issued(id):
-    issued = Cart.query.get(id)
-
-    issuance = Issued(
-        user_id=issued.user_id,
-        book_id=issued.book_id,
-        username=issued.username,
-        book_name=issued.book.name,
-        author=issued.book.author,
-        date_issued=issued.book.date_issued,
-        return_date=issued.book.return_date,
-    )
+    counts = loans.approve_requests(cart_ids=[id])
 
-    db.session.add(issuance)
-    db.session.delete(issued)
-    db.session.commit()
+    if not counts["issued"]:
+        flash("Request does not exist or the book is already issued")
+        return redirect(url_for("cart"))
 
     flash("Books issued successfully")
     return redirect(url_for("cart"))
 
 
+# ----------------------------------Batch Requests------------------------------------------- #
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# the requests picked by a batch form or json body: cart_id (list),
+# book_id and older_than_days. Raises ValueError for a malformed json body,
+# the form fields just ignore values that are not numbers
+def batch_filters():
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise ValueError("The body must be a JSON object")
+
+        cart_ids = data.get("cart_ids")
+        book_id = data.get("book_id")
+        older_than_days = data.get("older_than_days")
+        if cart_ids is not None and not (
+            isinstance(cart_ids, list) and all(is_int(id) for id in cart_ids)
+        ):
+            raise ValueError("cart_ids must be a list of integers")
+        if book_id is not None and not is_int(book_id):
+            raise ValueError("book_id must be an integer")
+        if older_than_days is not None and not is_int(older_than_days):
+            raise ValueError("older_than_days must be an integer")
+    else:
+        cart_ids = request.form.getlist("cart_id", type=int) or None
+        book_id = request.form.get("book_id", type=int)
+        older_than_days = request.form.get("older_than_days", type=int)
+
+    return {
+        "cart_ids": cart_ids,
+        "book_id": book_id,
+        "older_than_days": older_than_days,
+    }
+
+
+@app.route("/cart/approve", methods=["POST"])
+@admin_required
+def approve_requests():
+    try:
+        filters = batch_filters()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    counts = loans.approve_requests(**filters)
+
+    if request.is_json:
+        return jsonify(counts)
+    flash(f"{counts['issued']} books issued, {counts['removed']} requests cleared")
+    return redirect(url_for("cart"))
+
+
+@app.route("/cart/reject", methods=["POST"])
+@admin_required
+def reject_requests():
+    try:
+        filters = batch_filters()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    counts = loans.reject_requests(**filters)
+
+    if request.is_json:
+        return jsonify(counts)
+    flash(f"{counts['rejected']} requests rejected")
+    return redirect(url_for("cart"))
+
+
 @app.route("/issued_books")
 @admin_required
 def issued_books():
-    all_issued = Issued.query.all()
+    # names are copied into Issued, so the books table is never needed;
+    # raiseload makes a template that reaches for item.books fail loudly
+    # instead of running one SELECT per row
+    query = Issued.query.options(db.raiseload("*"))
+    page = keyset_page(query, Issued.id, cursor())
     now = datetime.now().strftime("%Y-%m-%d")
-    return render_template("issued.html", all_issued=all_issued, now=now)
+    return render_template("issued.html", all_issued=page.items, page=page, now=now)
 
 
 @app.route("/revoke_book/<int:book_id>/<int:user_id>", methods=["POST"])
@@ -610,8 +749,22 @@ def revoke_book(book_id, user_id):
 
 @app.route("/issued_books_user")
 @auth_required
+@read_only
 def issued_books_user():
-    all_issued = Issued.query.filter_by(user_id=session["user_id"]).all()
+    all_issued = (
+        Issued.query.filter_by(user_id=session["user_id"])
+        .options(
+            db.load_only(
+                Issued.book_id,
+                Issued.book_name,
+                Issued.author,
+                Issued.date_issued,
+                Issued.return_date,
+            ),
+            db.raiseload("*"),
+        )
+        .all()
+    )
     return render_template("library.html", all_issued=all_issued)
 
 
@@ -654,6 +807,7 @@ def give_feedbacks_post(id):
         date_of_feedback=datetime.now(),
     )
     db.session.add(book_feedback)
+    feedback_summary.add_feedback(book_feedback)
     db.session.commit()
     flash("Feedback given successfully")
     return redirect(url_for("issued_books_user"))
@@ -662,15 +816,97 @@ def give_feedbacks_post(id):
 @app.route("/show_feedbacks")
 @admin_required
 def show_feedbacks():
-    feedbacks = Feedbacks.query.all()
-    return render_template("show_feedbacks.html", feedbacks=feedbacks)
+    page = keyset_page(Feedbacks.query, Feedbacks.id, cursor())
+    return render_template("show_feedbacks.html", feedbacks=page.items, page=page)
 
 
 @app.route("/show_feedbacks/<int:book_id>")
 @auth_required
+@read_only
 def show_feedbacks_user(book_id):
-    feedbacks = Feedbacks.query.filter_by(book_id=book_id).all()
-    return render_template("show_feedbacks.html", feedbacks=feedbacks)
+    # a new feedback changes the summary, a renamed book its updated_at;
+    # neither needs to count the book's feedbacks
+    book_updated_at, count, latest_date, summary_updated_at = (
+        db.session.query(
+            Books.updated_at,
+            FeedbackSummary.count,
+            FeedbackSummary.latest_date,
+            FeedbackSummary.updated_at,
+        )
+        .outerjoin(FeedbackSummary, FeedbackSummary.book_id == Books.id)
+        .filter(Books.id == book_id)
+        .first()
+    ) or (None, None, None, None)
+    updated_at = max(filter(None, (book_updated_at, summary_updated_at)), default=None)
+
+    # only the current page of full feedback texts is loaded
+    def render():
+        page = keyset_page(
+            Feedbacks.query.filter_by(book_id=book_id), Feedbacks.id, cursor()
+        )
+        return render_template(
+            "show_feedbacks.html",
+            feedbacks=page.items,
+            page=page,
+            count=count,
+            latest_date=latest_date,
+        )
+
+    return conditional.respond(
+        conditional.make_etag(book_updated_at, count, summary_updated_at),
+        updated_at,
+        render,
+    )
+
+
+# ----------------------------------Metrics------------------------------------------- #
+
+
+# per route request, SQL and template figures for Prometheus, see profiling.py
+@app.route("/metrics")
+def metrics():
+    if not app.config["PROFILING"]:
+        return Response("Profiling is disabled\n", status=404, mimetype="text/plain")
+
+    token = app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    return Response(profiling.metrics_text(), mimetype="text/plain; version=0.0.4")
+
+
+# ----------------------------------Exports------------------------------------------- #
+
+
+# streams loan or feedback history as csv or ndjson, e.g.
+# /export/issued.csv?since=2024-01-01&until=2024-12-31&user_id=3&book_id=7
+@app.route("/export/<name>.<file_format>")
+@admin_required
+def export(name, file_format):
+    if name not in exports.EXPORTS or file_format not in exports.FORMATS:
+        flash("No such export")
+        return redirect(url_for("admin"))
+
+    def date_arg(key):
+        value = request.args.get(key)
+        return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+    try:
+        filters = {
+            "since": date_arg("since"),
+            "until": date_arg("until"),
+            "user_id": request.args.get("user_id", type=int),
+            "book_id": request.args.get("book_id", type=int),
+        }
+    except ValueError:
+        flash("Dates must be given as YYYY-MM-DD")
+        return redirect(url_for("admin"))
+
+    return Response(
+        stream_with_context(exports.export_rows(name, file_format, **filters)),
+        mimetype=exports.FORMATS[file_format],
+        headers={"Content-Disposition": f"attachment; filename={name}.{file_format}"},
+    )
 
 
 # ----------------------------------Set Date------------------------------------------- #
@@ -683,59 +919,83 @@ def set_date():
     new_date = request.form.get("new_date")
     new_date = datetime.strptime(new_date, "%Y-%m-%d").date()
 
-    issued_books = Issued.query.all()
-
-    # if set_date > request date then revoke access
-    for issued in issued_books:
-        if new_date > issued.return_date:
-            db.session.delete(issued)
+    # if set_date > return date then revoke access
+    revoked = loans.revoke_overdue(new_date)
 
-    db.session.commit()
-    flash("Successfully revoked books passed the return date.")
+    flash(f"Successfully revoked {revoked} books passed the return date.")
     return redirect(url_for("issued_books"))
 
 
 # ----------------------------------Read Book------------------------------------------- #
 
 
-@app.route("/readbook/<int:id>", methods=["POST"])
+@app.route("/readbook/<int:id>", methods=["GET", "POST"])
 @auth_required
+@read_only
 def read_book(id):
     book = Books.query.get(id)
     if not book:
         flash("No such book exists")
         return redirect(url_for("issued_books_user"))
-    return render_template("read_book.html", book=book)
+
+    # only the requested page is read from the database; a book without
+    # pages yet is shown whole rather than converted by this GET
+    pages = reader.page_count(id)
+    page = max(1, min(request.values.get("page", 1, type=int), pages))
+
+    return conditional.respond(
+        conditional.make_etag(id, book.updated_at, page),
+        book.updated_at,
+        lambda: render_template(
+            "read_book.html",
+            book=book,
+            page=page,
+            pages=max(pages, 1),
+            text=reader.read_page(id, page) if pages else reader.full_content(id),
+        ),
+    )
+
+
+# the whole book as plain text, streamed page by page
+@app.route("/readbook/<int:id>/full", methods=["GET", "POST"])
+@auth_required
+@read_only
+def read_book_full(id):
+    book = Books.query.get(id)
+    if not book:
+        flash("No such book exists")
+        return redirect(url_for("issued_books_user"))
+
+    return Response(
+        stream_with_context(reader.stream_content(id)),
+        mimetype="text/plain; charset=utf-8",
+    )
 
 
 # -------------------------------------Download Book------------------------------------------------- #
 
 
-@app.route("/download_pdf/<int:id>", methods=["POST"])
+@app.route("/download_pdf/<int:id>", methods=["GET", "POST"])
 @auth_required
 def download_book(id):
     book = Books.query.get(id)
 
-    name = book.name
-    author = book.author
-    content = book.content
-
-    # Generate HTML content with book details and content
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>{name} by {author}</title>
-    </head>
-    <body>
-        <h1>{name}</h1>
-        <h2>by {author}</h2>
-        <br> 
-        <div>{content}</div>
-    </body>
-    </html>
-    """
-
-    filename = f"{name}.pdf"
-    HTML(string=html_content).write_pdf(filename)
-    return send_file(filename, as_attachment=True)
+    if not book:
+        flash("No such book exists")
+        return redirect(url_for("issued_books_user"))
+
+    # rendered in the pdf worker pool, repeat downloads come from the cache;
+    # a revalidation neither loads the content nor touches the pdf
+    def render():
+        filename = pdf_cache.get_pdf(book)
+        return send_file(
+            filename,
+            as_attachment=True,
+            download_name=f"{book.name}.pdf",
+            etag=False,
+            conditional=False,
+        )
+
+    return conditional.respond(
+        conditional.make_etag(id, book.updated_at), book.updated_at, render
+    )
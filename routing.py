@@ -0,0 +1,93 @@
+import random
+import time
+from functools import wraps
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+from app import app
+
+# Read/write routing. Views decorated with @read_only send their SELECTs to
+# one of the read engines configured in SQLALCHEMY_READ_URIS (kept in
+# SQLALCHEMY_BINDS as "read_0", "read_1", ...); everything else, every
+# flush and every INSERT/UPDATE/DELETE goes to the primary database.
+#
+# Read-your-writes: once a request has written to the primary, the rest of
+# that request and the same user's requests for the next
+# READ_PRIMARY_STICKY_SECONDS read from the primary too, so a replica that
+# is a little behind never hides what the user just did.
+#
+# Locally: cp instance/db.sqlite3 instance/replica.sqlite3 and run with
+# SQLALCHEMY_READ_URIS=sqlite:///replica.sqlite3 (or two Postgres URIs).
+
+READ_BIND_PREFIX = "read_"
+
+
+def read_binds():
+    return [
+        key
+        for key in app.config.get("SQLALCHEMY_BINDS", {})
+        if key and key.startswith(READ_BIND_PREFIX)
+    ]
+
+
+def read_only(func):
+    @wraps(func)
+    def inner(*args, **kwargs):
+        g.read_only = True
+        return func(*args, **kwargs)
+
+    return inner
+
+
+def _use_replica():
+    if not has_request_context() or not g.get("read_only"):
+        return False
+    if g.get("db_written"):
+        return False
+    return session.get("read_primary_until", 0) < time.time()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and isinstance(clause, Select)
+            and _use_replica()
+        ):
+            binds = read_binds()
+            if binds:
+                # one replica per request, so its reads are consistent
+                if "read_bind" not in g:
+                    g.read_bind = random.choice(binds)
+                return self._db.engines[g.read_bind]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_flush(db_session, flush_context):
+    if has_request_context():
+        g.db_written = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_statement(orm_execute_state):
+    if has_request_context() and (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        g.db_written = True
+
+
+@app.after_request
+def stick_to_primary(response):
+    if g.get("db_written") and read_binds():
+        session["read_primary_until"] = (
+            time.time() + app.config["READ_PRIMARY_STICKY_SECONDS"]
+        )
+    return response
@@ -0,0 +1,165 @@
+import re
+
+from sqlalchemy import text
+
+from models import db, Section, Books
+
+# The catalog search index is an SQLite FTS5 virtual table with one row
+# per book. The rowid of a row is the id of the book it indexes, so a match
+# can be joined straight back onto the books table.
+INDEX_TABLE = "book_search"
+
+# search parameter from the searchbar -> FTS5 column it matches against
+SEARCH_COLUMNS = {
+    "section_name": "section",
+    "book_name": "name",
+    "author_name": "author",
+}
+
+
+def is_available():
+    # FTS5 is an SQLite feature, other databases fall back to LIKE scans
+    return db.engine.dialect.name == "sqlite"
+
+
+def ensure_index():
+    if not is_available():
+        return
+
+    db.session.execute(
+        text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+            "name, author, section, section_id UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+    )
+
+    # databases created before the index existed get filled once
+    indexed = db.session.execute(text(f"SELECT count(*) FROM {INDEX_TABLE}")).scalar()
+    if not indexed and db.session.query(Books.id).first():
+        rebuild_index()
+    db.session.commit()
+
+
+def rebuild_index():
+    if not is_available():
+        return
+
+    db.session.execute(text(f"DELETE FROM {INDEX_TABLE}"))
+    db.session.execute(
+        text(
+            f"INSERT INTO {INDEX_TABLE} (rowid, name, author, section, section_id) "
+            "SELECT books.id, books.name, books.author, section.name, section.id "
+            "FROM books JOIN section ON section.id = books.section_id"
+        )
+    )
+
+
+# the functions below only write to the index, the caller commits them
+# together with the change to the book or section itself
+def index_book(book):
+    if not is_available():
+        return
+
+    db.session.flush()
+    remove_book(book.id)
+    db.session.execute(
+        text(
+            f"INSERT INTO {INDEX_TABLE} (rowid, name, author, section, section_id) "
+            "VALUES (:id, :name, :author, :section, :section_id)"
+        ),
+        {
+            "id": book.id,
+            "name": book.name,
+            "author": book.author,
+            "section": book.section.name,
+            "section_id": book.section.id,
+        },
+    )
+
+
+def remove_book(book_id):
+    if not is_available():
+        return
+
+    db.session.execute(
+        text(f"DELETE FROM {INDEX_TABLE} WHERE rowid = :id"), {"id": book_id}
+    )
+
+
+def index_section(section):
+    if not is_available():
+        return
+
+    db.session.execute(
+        text(f"UPDATE {INDEX_TABLE} SET section = :name WHERE section_id = :id"),
+        {"name": section.name, "id": section.id},
+    )
+
+
+def remove_section(section_id):
+    if not is_available():
+        return
+
+    db.session.execute(
+        text(f"DELETE FROM {INDEX_TABLE} WHERE section_id = :id"), {"id": section_id}
+    )
+
+
+def words(query):
+    return re.findall(r"\w+", (query or "").lower())
+
+
+def match_expression(parameter, query):
+    # every word of the query becomes a quoted prefix term, so user input
+    # can never be parsed as FTS5 syntax and "dun" still finds "Dune"
+    query_words = words(query)
+    if not query_words:
+        return None
+
+    column = SEARCH_COLUMNS[parameter]
+    return " AND ".join(f'{column} : "{word}"*' for word in query_words)
+
+
+# the books matching a search as a subquery of (book_id, rank), or None for
+# no search. rank is FTS5's bm25 score, lower is a better match;
+# catalog.search_page() shows the best matches first and pages through them,
+# so a search that matches half the library still renders one page
+def search_matches(parameter, query):
+    if parameter not in SEARCH_COLUMNS:
+        return None
+
+    if not is_available():
+        return _search_matches_like(parameter, query)
+
+    match = match_expression(parameter, query)
+    if match is None:
+        return None
+
+    return (
+        text(
+            f"SELECT rowid AS book_id, rank FROM {INDEX_TABLE} "
+            f"WHERE {INDEX_TABLE} MATCH :match"
+        )
+        .bindparams(match=match)
+        .columns(book_id=db.Integer, rank=db.Float)
+        .subquery()
+    )
+
+
+# without FTS5 every match ranks the same, so results come in id order
+def _search_matches_like(parameter, query):
+    if not query:
+        return None
+
+    column = {
+        "section_name": Section.name,
+        "book_name": Books.name,
+        "author_name": Books.author,
+    }[parameter]
+    return (
+        db.select(Books.id.label("book_id"), db.literal(0.0).label("rank"))
+        .join(Section, Section.id == Books.section_id)
+        .where(column.ilike(f"%{query}%"))
+        .subquery()
+    )
@@ -0,0 +1,41 @@
+from models import db, Section, Books, Cart, Issued, Feedbacks
+
+
+# every section with its number of books, counted by the database in one
+# GROUP BY query instead of loading section.books for each section
+def section_counts():
+    book_counts = (
+        db.session.query(Books.section_id, db.func.count(Books.id).label("book_count"))
+        .group_by(Books.section_id)
+        .subquery()
+    )
+
+    return (
+        db.session.query(
+            Section.id,
+            Section.name,
+            db.func.coalesce(book_counts.c.book_count, 0).label("book_count"),
+        )
+        .outerjoin(book_counts, book_counts.c.section_id == Section.id)
+        .order_by(Section.id)
+        .all()
+    )
+
+
+# library wide totals for the dashboard statistics, fetched as scalar
+# subqueries of one SELECT; add a model here to show another total
+LIBRARY_COUNTS = {
+    "sections": Section,
+    "books": Books,
+    "requested": Cart,
+    "issued": Issued,
+    "feedbacks": Feedbacks,
+}
+
+
+def library_counts():
+    columns = [
+        db.select(db.func.count()).select_from(model).scalar_subquery().label(name)
+        for name, model in LIBRARY_COUNTS.items()
+    ]
+    return db.session.query(*columns).one()._asdict()